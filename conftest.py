@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def strict_query_budgets(settings):
+    """Тесты падают, если view выходит за свой бюджет запросов к базе."""
+    settings.QUERY_BUDGET_STRICT = True
+
+
+@pytest.fixture(autouse=True)
+def temporary_media_root(settings, tmp_path):
+    """Загрузки тестов не попадают в настоящий MEDIA_ROOT."""
+    settings.MEDIA_ROOT = str(tmp_path)
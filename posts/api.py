@@ -0,0 +1,111 @@
+from functools import wraps
+
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+
+from . import page_cache, thumbnails
+from .conditional import conditional_tagged
+from .follow_feed import paginate_follow_feed
+from .models import Group, Post, User
+from .pagination import paginate
+
+
+def serialize_images(post):
+    """{формат: {ширина: url}} готовых вариантов карточки или None."""
+    if not post.image or not post.thumbnails_ready:
+        return None
+    images = {}
+    for image_format, items in thumbnails.variants('card').items():
+        for width, _, name in items:
+            thumbnail = thumbnails.lookup(post.image, name)
+            if thumbnail is None:
+                return None
+            images.setdefault(image_format.lower(), {})[str(width)] = (
+                thumbnail.url
+            )
+    return images or None
+
+
+def serialize_post(post):
+    return {
+        'id': post.pk,
+        'author': post.author.username,
+        'group': post.group.slug if post.group_id else None,
+        'text': post.text,
+        'pub_date': post.pub_date.isoformat(),
+        'comments': post.comment_count,
+        'images': serialize_images(post),
+    }
+
+
+def page_response(page):
+    posts = list(page)
+    thumbnails.prefetch(posts)
+    return JsonResponse({
+        'results': [serialize_post(post) for post in posts],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+@conditional_tagged(page_cache.index_tags)
+@page_cache.cache_page_tagged(page_cache.index_tags)
+def index(request):
+    _, page = paginate(request, Post.objects.for_feed())
+    return page_response(page)
+
+
+@conditional_tagged(page_cache.group_tags)
+@page_cache.cache_page_tagged(page_cache.group_tags)
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    _, page = paginate(request, group.posts.for_feed())
+    return page_response(page)
+
+
+@conditional_tagged(page_cache.profile_tags)
+@page_cache.cache_page_tagged(page_cache.profile_tags)
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    _, page = paginate(request, author.posts.for_feed())
+    return page_response(page)
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'detail': 'Нужен вход'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@api_login_required
+@conditional_tagged(page_cache.follow_tags)
+@page_cache.cache_page_tagged(page_cache.follow_tags)
+def follow_index(request):
+    _, page = paginate_follow_feed(request, request.user)
+    return page_response(page)
+
+
+def post_tags(request, post_id):
+    return [f'post:{post_id}', 'groups']
+
+
+@conditional_tagged(post_tags)
+def post_view(request, post_id):
+    post = get_object_or_404(Post.objects.for_feed(), pk=post_id)
+    data = serialize_post(post)
+    data['comment_list'] = [
+        {
+            'id': pk, 'author': username, 'text': text,
+            'created': created.isoformat(),
+        }
+        for pk, username, text, created in post.comments.values_list(
+            'pk', 'author__username', 'text', 'created'
+        )
+    ]
+    return JsonResponse(
+        data, json_dumps_params={'ensure_ascii': False,
+                                 'separators': (',', ':')}
+    )
@@ -0,0 +1,284 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from urllib import error, parse, request as urlrequest
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from .models import Group, Post, User, UserCounter
+from .query_budget import QueryCounter
+
+VIEWS = (
+    'index', 'group_posts', 'profile', 'post_view', 'follow_index',
+    'new_post', 'add_comment',
+)
+POOL_SIZE = 100
+# Сравнение с базовой линией: метрика, единица и растёт ли она к худшему.
+METRICS = (
+    ('p50', 'мс', True), ('p95', 'мс', True), ('p99', 'мс', True),
+    ('queries', 'запросов', True), ('throughput', 'запр/с', False),
+)
+
+
+def baseline_dir():
+    return getattr(settings, 'BENCHMARK_DIR',
+                   os.path.join(settings.BASE_DIR, 'benchmarks'))
+
+
+def percentile(values, q):
+    """Перцентиль по ближайшему рангу; values отсортированы."""
+    if not values:
+        return 0
+    rank = max(math.ceil(q / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+class Targets:
+    """Случайные, но воспроизводимые по seed адреса для сценариев."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        bounds = Post.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            raise LookupError('В базе нет постов')
+        self.posts = []
+        for _ in range(POOL_SIZE):
+            row = Post.objects.filter(
+                pk__gte=rng.randint(bounds['low'], bounds['high'])
+            ).order_by('pk').values_list('pk', 'author__username').first()
+            if row is not None:
+                self.posts.append(row)
+        self.groups = list(Group.objects.values_list('slug', flat=True))
+        counter = UserCounter.objects.order_by('-following_count').first()
+        self.viewer = (
+            counter.user if counter is not None
+            else User.objects.order_by('pk').first()
+        )
+
+    def post(self):
+        return self.rng.choice(self.posts)
+
+    def request(self, view):
+        """(метод, путь, данные формы) очередного запроса к view."""
+        if view == 'index':
+            return 'GET', reverse('index'), None
+        if view == 'group_posts':
+            if not self.groups:
+                raise LookupError('В базе нет групп')
+            slug = self.rng.choice(self.groups)
+            return 'GET', reverse('group', kwargs={'slug': slug}), None
+        if view == 'profile':
+            _, username = self.post()
+            return 'GET', reverse(
+                'profile', kwargs={'username': username}
+            ), None
+        if view == 'post_view':
+            post_id, username = self.post()
+            return 'GET', reverse('post', kwargs={
+                'username': username, 'post_id': post_id
+            }), None
+        if view == 'follow_index':
+            return 'GET', reverse('follow_index'), None
+        text = f'Нагрузочный тест {get_random_string(8)}'
+        if view == 'new_post':
+            return 'POST', reverse('new_post'), {'text': text}
+        post_id, username = self.post()
+        return 'POST', reverse('add_comment', kwargs={
+            'username': username, 'post_id': post_id
+        }), {'text': text}
+
+
+class ClientDriver:
+    """Запросы тестовым клиентом Django в этом же процессе."""
+
+    def __init__(self, viewer, counter):
+        self.counter = counter
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(viewer)
+
+    def __call__(self, method, path, data):
+        with connection.execute_wrapper(self.counter):
+            if method == 'POST':
+                return self.client.post(path, data).status_code
+            return self.client.get(path).status_code
+
+    def close(self):
+        pass
+
+
+class NoRedirect(urlrequest.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class WSGIDriver:
+    """
+    Запросы по HTTP к локальному WSGI-серверу в отдельном потоке.
+
+    Запросы к базе считаются в потоке сервера, где выполняется view.
+    """
+
+    def __init__(self, viewer, counter):
+        self.counter = counter
+        handler = WSGIHandler()
+
+        def app(environ, start_response):
+            with connection.execute_wrapper(counter):
+                return handler(environ, start_response)
+
+        self.server = make_server(
+            '127.0.0.1', 0, app, handler_class=QuietHandler
+        )
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self.thread.start()
+        self.base = f'http://localhost:{self.server.server_port}'
+        login = Client()
+        login.force_login(viewer)
+        session = login.cookies[settings.SESSION_COOKIE_NAME].value
+        self.csrf = get_random_string(32)
+        self.cookie = (f'{settings.SESSION_COOKIE_NAME}={session}; '
+                       f'{settings.CSRF_COOKIE_NAME}={self.csrf}')
+        self.opener = urlrequest.build_opener(NoRedirect)
+
+    def __call__(self, method, path, data):
+        headers = {'Cookie': self.cookie}
+        body = None
+        if method == 'POST':
+            body = parse.urlencode(data).encode()
+            headers['X-CSRFToken'] = self.csrf
+        http_request = urlrequest.Request(
+            self.base + path, data=body, headers=headers, method=method
+        )
+        try:
+            with self.opener.open(http_request) as response:
+                response.read()
+                return response.status
+        except error.HTTPError as response:
+            return response.code
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+DRIVERS = {'client': ClientDriver, 'wsgi': WSGIDriver}
+
+
+def run(views, mode='client', requests=200, warmup=20, seed=1, cold=False):
+    """
+    Прогоняет сценарии по очереди; возвращает {view: метрики}.
+
+    Время — в миллисекундах, queries и sql_ms — в среднем на запрос,
+    throughput — запросов в секунду при последовательной подаче. С cold
+    кеш очищается перед каждым запросом.
+    """
+    rng = random.Random(seed)
+    targets = Targets(rng)
+    counter = QueryCounter()
+    driver = DRIVERS[mode](targets.viewer, counter)
+    results = {}
+    try:
+        for view in views:
+            expected = 302 if view in ('new_post', 'add_comment') else 200
+            for _ in range(warmup):
+                driver(*targets.request(view))
+            latencies, errors, queries, sql = [], 0, 0, 0
+            for _ in range(requests):
+                method, path, data = targets.request(view)
+                if cold:
+                    cache.clear()
+                counter.reset()
+                started = time.perf_counter()
+                status = driver(method, path, data)
+                latencies.append(time.perf_counter() - started)
+                queries += counter.queries
+                sql += counter.seconds
+                errors += status != expected
+            latencies.sort()
+            total = sum(latencies)
+            results[view] = {
+                'requests': requests,
+                'errors': errors,
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'queries': queries / requests,
+                'sql_ms': sql / requests * 1000,
+                'throughput': requests / total if total else 0,
+            }
+    finally:
+        driver.close()
+    return results
+
+
+def format_result(view, result):
+    return (
+        f'{view}: p50 {result["p50"]:.1f} мс, p95 {result["p95"]:.1f} мс, '
+        f'p99 {result["p99"]:.1f} мс, {result["queries"]:.1f} запросов '
+        f'({result["sql_ms"]:.1f} мс SQL), '
+        f'{result["throughput"]:.0f} запр/с, ошибок: {result["errors"]}'
+    )
+
+
+def baseline_path(name):
+    return os.path.join(baseline_dir(), f'{name}.json')
+
+
+def save_baseline(name, results, **meta):
+    path = baseline_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump({'meta': meta, 'results': results}, output, indent=2,
+                  ensure_ascii=False)
+    return path
+
+
+def load_baseline(name):
+    """(результаты, условия прогона) сохранённой базовой линии."""
+    with open(baseline_path(name), encoding='utf-8') as source:
+        saved = json.load(source)
+    return saved['results'], saved['meta']
+
+
+def compare(results, baseline, threshold):
+    """
+    Строки сравнения с базовой линией и флаг регрессии для каждой.
+
+    Регрессия — ухудшение метрики больше чем на threshold процентов.
+    """
+    rows = []
+    for view, result in results.items():
+        old = baseline.get(view)
+        if old is None:
+            continue
+        for metric, unit, higher_is_worse in METRICS:
+            before, after = old[metric], result[metric]
+            if before:
+                change = (after - before) / before * 100
+            else:
+                change = math.inf if after else 0
+            worse = change if higher_is_worse else -change
+            rows.append((
+                f'{view} {metric}: {before:.1f} → {after:.1f} {unit} '
+                f'({change:+.0f}%)',
+                worse > threshold,
+            ))
+    return rows
@@ -0,0 +1,156 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition, require_safe
+
+from . import page_cache, thumbnails
+from .models import Post, UserCounter
+
+
+def max_age():
+    return getattr(settings, 'PAGE_MAX_AGE', 60)
+
+
+def groups_version():
+    """Поколение тега groups: названия групп есть на страницах постов."""
+    return page_cache.tag_versions(['groups'])[0][0]
+
+
+def post_version(request, username, post_id):
+    """Время правки и счётчики поста одним запросом или None."""
+    row = Post.objects.filter(
+        pk=post_id, author__username=username
+    ).values_list(
+        'edited', 'comment_count', 'thumbnails_ready', 'thumbnails_version',
+        'author__counters__posts_count',
+    ).first()
+    if row is None:
+        return None
+    return row + (groups_version(),)
+
+
+def profile_version(request, username):
+    """
+    Версия профиля по строке UserCounter или None.
+
+    Посты, комментарии к ним и миниатюры меняют время правки и счётчик
+    изменений, подписки — свои счётчики.
+    """
+    row = UserCounter.objects.filter(user__username=username).values_list(
+        'edited', 'changes', 'posts_count', 'followers_count',
+        'following_count',
+    ).first()
+    if row is None:
+        return None
+    return row + (groups_version(),)
+
+
+def conditional_page(get_version):
+    """
+    ETag и Cache-Control для страницы по её версии.
+
+    get_version(request, **kwargs) делает один лёгкий запрос и возвращает
+    версию страницы или None, если страницы нет. При совпадении ETag ответ
+    304 отдаётся без основных запросов и рендеринга. Last-Modified не
+    отправляется: новый комментарий или подписка меняют страницу, но не
+    время правки. Анонимные ответы можно хранить в общих кешах
+    PAGE_MAX_AGE секунд, ответы пользователям — только в браузере с
+    перепроверкой.
+    """
+    def version(request, *args, **kwargs):
+        if not hasattr(request, 'page_version'):
+            request.page_version = get_version(request, *args, **kwargs)
+        return request.page_version
+
+    def etag(request, *args, **kwargs):
+        current = version(request, *args, **kwargs)
+        if current is None:
+            return None
+        user_id = request.user.pk if request.user.is_authenticated else 0
+        raw = (f'{request.get_full_path()}|{user_id}|'
+               f'{thumbnails.presets_version()}|{current!r}')
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                return response
+            if getattr(request, 'page_cache_stale', False):
+                # Старая копия из кеша страниц не должна получить валидаторы
+                # новой версии.
+                patch_cache_control(response, no_store=True)
+            elif request.user.is_authenticated or response.cookies:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(
+                    response, public=True, max_age=max_age()
+                )
+            patch_vary_headers(response, ['Cookie'])
+            return response
+        return wrapper
+    return decorator
+
+
+def versions_for(request, get_tags, *args, **kwargs):
+    """Поколения тегов страницы; считаются один раз на запрос."""
+    if not hasattr(request, 'page_versions'):
+        request.page_versions = page_cache.tag_versions(
+            get_tags(request, *args, **kwargs)
+        )
+    return request.page_versions
+
+
+def conditional_tagged(get_tags, per_user=True):
+    """
+    ETag и Last-Modified из поколений тегов кеша страниц.
+
+    Теги сбрасываются при любом изменении, видном в ленте (новый пост,
+    правка, комментарий), поэтому валидаторы стоят одного get_many к
+    кешу. На совпавший If-None-Match или If-Modified-Since ответ 304
+    отдаётся до запросов к базе и рендеринга. С кешем в памяти процесса
+    поколения живут PAGE_CACHE_LOCAL_TTL секунд (page_cache.tag_timeout),
+    так что и валидаторы устаревают не позже. Без per_user ответ один для
+    всех зрителей и не помечается как private.
+    """
+    def etag(request, *args, **kwargs):
+        versions = versions_for(request, get_tags, *args, **kwargs)
+        user_id = page_cache.viewer_id(request, per_user)
+        raw = '|'.join(
+            [request.get_full_path(), str(user_id)]
+            + [token for token, _ in versions]
+        )
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        versions = versions_for(request, get_tags, *args, **kwargs)
+        return datetime.fromtimestamp(
+            int(max(bumped_at for _, bumped_at in versions)), timezone.utc
+        )
+
+    def decorator(view):
+        conditional_view = require_safe(
+            condition(etag_func=etag, last_modified_func=last_modified)(view)
+        )
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if getattr(request, 'page_cache_stale', False):
+                # Старая копия из кеша страниц не должна получить валидаторы
+                # новых поколений, иначе клиент хранил бы её до следующего
+                # сброса тегов.
+                patch_cache_control(response, no_store=True)
+            else:
+                patch_cache_control(response, no_cache=True)
+            if per_user and request.user.is_authenticated:
+                patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
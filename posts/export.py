@@ -0,0 +1,92 @@
+import csv
+import json
+
+from .models import Comment, Follow, Group, Post
+
+CHUNK_SIZE = 2000
+KINDS = ('group', 'post', 'comment', 'follow')
+
+# Поля каждой строки выгрузки и откуда они берутся. Формат совпадает с
+# входом import_content: посты несут ref, комментарии — post_ref.
+PROJECTIONS = {
+    'group': (Group, [
+        ('slug', 'slug'), ('title', 'title'),
+        ('description', 'description'),
+    ]),
+    'post': (Post, [
+        ('ref', 'pk'), ('author', 'author__username'),
+        ('group', 'group__slug'), ('text', 'text'),
+        ('pub_date', 'pub_date'), ('image', 'image'),
+    ]),
+    'comment': (Comment, [
+        ('post_ref', 'post_id'), ('author', 'author__username'),
+        ('text', 'text'), ('created', 'created'),
+    ]),
+    'follow': (Follow, [
+        ('user', 'user__username'), ('author', 'author__username'),
+    ]),
+}
+COLUMNS = ['type'] + list(dict.fromkeys(
+    column for _, fields in PROJECTIONS.values() for column, _ in fields
+))
+
+
+def rows(kinds=KINDS, chunk_size=CHUNK_SIZE):
+    """
+    Строки выгрузки словарями, по одной модели за другой.
+
+    Каждая модель читается одним запросом values_list(...).iterator(), без
+    создания объектов моделей, так что память не растёт с числом строк.
+    """
+    for kind in KINDS:
+        if kind not in kinds:
+            continue
+        model, fields = PROJECTIONS[kind]
+        columns = [column for column, _ in fields]
+        values = model.objects.order_by('pk').values_list(
+            *(lookup for _, lookup in fields)
+        )
+        for row in values.iterator(chunk_size=chunk_size):
+            item = {'type': kind}
+            for column, value in zip(columns, row):
+                if hasattr(value, 'isoformat'):
+                    value = value.isoformat()
+                if value not in (None, ''):
+                    item[column] = value
+            yield item
+
+
+class Echo:
+    """Файлоподобный объект, который отдаёт записанное обратно."""
+
+    def write(self, value):
+        return value
+
+
+def render_jsonl(items):
+    for item in items:
+        yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+def render_csv(items):
+    writer = csv.DictWriter(Echo(), COLUMNS)
+    yield writer.writeheader()
+    for item in items:
+        yield writer.writerow(item)
+
+
+RENDERERS = {
+    'jsonl': (render_jsonl, 'application/x-ndjson'),
+    'csv': (render_csv, 'text/csv'),
+}
+
+
+def parse_kinds(value):
+    """Список типов из строки вида post,comment; пустая — все."""
+    if not value:
+        return KINDS
+    kinds = [kind.strip() for kind in value.split(',')]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise ValueError(f'Неизвестные типы: {", ".join(sorted(unknown))}')
+    return kinds
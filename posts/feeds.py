@@ -0,0 +1,137 @@
+import textwrap
+
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+
+from . import page_cache
+from .conditional import conditional_tagged
+from .models import Group, Post, User
+
+
+def feed_size():
+    return getattr(settings, 'SYNDICATION_FEED_SIZE', 20)
+
+
+def latest(queryset):
+    """Последние посты тем же запросом, что и ленты, по индексу даты."""
+    return queryset.for_feed().order_by('-pub_date', '-pk')[:feed_size()]
+
+
+class PostsFeed(Feed):
+    """RSS последних постов сайта."""
+    title = 'Yatube: последние записи'
+    description = 'Новые записи всех авторов'
+
+    def __call__(self, request, *args, **kwargs):
+        response = super().__call__(request, *args, **kwargs)
+        # Last-Modified ставит conditional_tagged по поколениям тегов: так
+        # If-Modified-Since сверяется с тем же, что и ETag.
+        del response['Last-Modified']
+        return response
+
+    def link(self):
+        return reverse('index')
+
+    def items(self):
+        return latest(Post.objects.all())
+
+    def item_title(self, item):
+        return textwrap.shorten(item.text, width=80, placeholder='…')
+
+    def item_description(self, item):
+        return item.text
+
+    def item_link(self, item):
+        return reverse('post', kwargs={
+            'username': item.author.username, 'post_id': item.pk
+        })
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_updateddate(self, item):
+        return item.edited
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+    def item_categories(self, item):
+        return [item.group.title] if item.group_id else []
+
+
+class GroupFeed(PostsFeed):
+    """RSS последних постов группы."""
+
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def title(self, obj):
+        return f'Yatube: {obj.title}'
+
+    def description(self, obj):
+        return obj.description or f'Записи сообщества {obj.title}'
+
+    def link(self, obj):
+        return reverse('group', kwargs={'slug': obj.slug})
+
+    def items(self, obj):
+        return latest(obj.posts)
+
+
+class AuthorFeed(PostsFeed):
+    """RSS последних постов автора."""
+
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, obj):
+        return f'Yatube: {obj.get_full_name() or obj.username}'
+
+    def description(self, obj):
+        return f'Записи пользователя {obj.username}'
+
+    def link(self, obj):
+        return reverse('profile', kwargs={'username': obj.username})
+
+    def items(self, obj):
+        return latest(obj.posts)
+
+
+class PostsAtomFeed(PostsFeed):
+    feed_type = Atom1Feed
+    subtitle = PostsFeed.description
+
+
+class GroupAtomFeed(GroupFeed):
+    feed_type = Atom1Feed
+    subtitle = GroupFeed.description
+
+
+class AuthorAtomFeed(AuthorFeed):
+    feed_type = Atom1Feed
+    subtitle = AuthorFeed.description
+
+
+def feed_view(feed_class, get_tags):
+    """
+    View ленты с кешем страниц и условным GET.
+
+    Лента хранится в кеше до сброса тегов её HTML-страницы (новый пост,
+    правка, комментарий), одна копия на всех: от зрителя она не зависит.
+    Клиенты, опрашивающие её с If-None-Match или If-Modified-Since,
+    получают 304 без запросов к базе.
+    """
+    return conditional_tagged(get_tags, per_user=False)(
+        page_cache.cache_page_tagged(get_tags, per_user=False)(feed_class())
+    )
+
+
+site_rss = feed_view(PostsFeed, page_cache.index_tags)
+site_atom = feed_view(PostsAtomFeed, page_cache.index_tags)
+group_rss = feed_view(GroupFeed, page_cache.group_tags)
+group_atom = feed_view(GroupAtomFeed, page_cache.group_tags)
+author_rss = feed_view(AuthorFeed, page_cache.profile_tags)
+author_atom = feed_view(AuthorAtomFeed, page_cache.profile_tags)
@@ -0,0 +1,282 @@
+import heapq
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+
+from .models import FeedEntry, Follow, Post, UserCounter
+from .pagination import (POSTS_PER_PAGE, get_cursors, keyset_window,
+                         paginate_rows)
+
+
+def inbox_enabled():
+    return getattr(settings, 'FOLLOW_FEED_INBOX', False)
+
+
+def inbox_size():
+    return getattr(settings, 'FOLLOW_FEED_INBOX_SIZE', 500)
+
+
+def pull_threshold():
+    return getattr(settings, 'FOLLOW_FEED_PULL_THRESHOLD', None)
+
+
+def is_pulled(author_id):
+    """Посты отмеченных авторов читаются при показе, а не раскладываются."""
+    return UserCounter.objects.filter(user_id=author_id, pulled=True).exists()
+
+
+def pulled_authors(user_id):
+    return list(Follow.objects.filter(
+        user_id=user_id, author__counters__pulled=True
+    ).values_list('author_id', flat=True))
+
+
+def mark_pulled(*author_ids):
+    """
+    Отмечает авторов, у которых подписчиков больше порога
+    FOLLOW_FEED_PULL_THRESHOLD: их новые посты в ящики не попадают.
+
+    Отметку снимает только unpull() из команды unpull_follow_feeds:
+    раскладка постов по ящикам всех подписчиков слишком тяжела для
+    запроса, а автор может колебаться около порога.
+    """
+    threshold = pull_threshold()
+    if threshold is None or not author_ids:
+        return
+    UserCounter.objects.filter(
+        user_id__in=author_ids, followers_count__gt=threshold, pulled=False
+    ).update(pulled=True)
+
+
+def unpull_candidates():
+    """Счётчики отмеченных авторов, чьих подписчиков уже не больше порога."""
+    authors = UserCounter.objects.filter(pulled=True)
+    threshold = pull_threshold()
+    if threshold is not None:
+        authors = authors.filter(followers_count__lte=threshold)
+    return authors
+
+
+# Пользователей в одном DELETE trim(): лимит переменных SQLite — 999.
+TRIM_BATCH = 500
+
+STATS_KEY = 'follow_feed:stats:{}:{}'
+STRATEGIES = ('push', 'pull')
+OPERATIONS = ('read', 'written')
+
+
+def record(strategy, operation, rows):
+    if not rows:
+        return
+    key = STATS_KEY.format(strategy, operation)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, rows)
+    except ValueError:
+        cache.set(key, rows, None)
+
+
+def stats():
+    """Сколько строк прочитала и записала каждая стратегия ленты."""
+    keys = {
+        (strategy, operation): STATS_KEY.format(strategy, operation)
+        for strategy in STRATEGIES for operation in OPERATIONS
+    }
+    values = cache.get_many(keys.values())
+    return {
+        pair: values.get(key, 0) for pair, key in keys.items()
+    }
+
+
+def reset_stats():
+    cache.delete_many([
+        STATS_KEY.format(strategy, operation)
+        for strategy in STRATEGIES for operation in OPERATIONS
+    ])
+
+
+def trim(user_ids):
+    """
+    Оставляет в ящиках пользователей последние inbox_size() записей.
+
+    Один DELETE на пачку пользователей: граница каждого ящика — дата его
+    inbox_size()-й записи. Записи с той же датой остаются, так что ящик
+    изредка бывает на пару записей больше.
+    """
+    user_ids = list(user_ids)
+    boundary = FeedEntry.objects.filter(
+        user_id=OuterRef('user_id')
+    ).order_by('-pub_date', '-post_id').values('pub_date')
+    boundary = boundary[inbox_size() - 1:inbox_size()]
+    for start in range(0, len(user_ids), TRIM_BATCH):
+        FeedEntry.objects.filter(
+            user_id__in=user_ids[start:start + TRIM_BATCH],
+            pub_date__lt=Subquery(boundary),
+        ).delete()
+
+
+def push(post, followers=None):
+    """Раскладывает новый пост по ящикам подписчиков автора."""
+    if is_pulled(post.author_id):
+        return 0
+    if followers is None:
+        followers = Follow.objects.filter(
+            author_id=post.author_id
+        ).values_list('user_id', flat=True)
+    followers = list(followers)
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(user_id=user_id, post_id=post.pk,
+                      pub_date=post.pub_date)
+            for user_id in followers
+        ],
+        ignore_conflicts=True,
+    )
+    trim(followers)
+    record('push', 'written', len(followers))
+    return len(followers)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ящик подписчика последние посты нового автора."""
+    if is_pulled(author_id):
+        return 0
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk'
+    ).values_list('pk', 'pub_date')[:inbox_size()]
+    entries = [
+        FeedEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts
+    ]
+    if not entries:
+        return 0
+    FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    trim([user_id])
+    record('push', 'written', len(entries))
+    return len(entries)
+
+
+def unpull(author_id):
+    """
+    Снимает с автора отметку mark_pulled() и раскладывает его последние
+    посты по ящикам подписчиков; возвращает их id или None, если автор
+    снова выше порога.
+
+    Пока автор был отмечен, его новые посты в ящики не попадали, а после
+    снятия отметки они больше не подмешиваются при чтении. Отметка
+    снимается до выборки постов: следующие посты разложит уже push().
+    """
+    if not unpull_candidates().filter(user_id=author_id).update(
+        pulled=False
+    ):
+        return None
+    followers = list(Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True))
+    posts = list(Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk'
+    ).values_list('pk', 'pub_date')[:inbox_size()])
+    if not posts:
+        return followers
+    for start in range(0, len(followers), TRIM_BATCH):
+        batch = followers[start:start + TRIM_BATCH]
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+                for user_id in batch for pk, pub_date in posts
+            ],
+            ignore_conflicts=True,
+        )
+        trim(batch)
+    record('push', 'written', len(followers) * len(posts))
+    return followers
+
+
+def prune(user_id, author_id):
+    """Убирает из ящика посты автора, от которого отписались."""
+    deleted, _ = FeedEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+    return deleted
+
+
+def rebuild(user_id):
+    """
+    Заполняет ящик заново последними inbox_size() постами подписок.
+
+    Один запрос по всем авторам сразу вместо backfill() для каждого:
+    результат тот же, но без лишних записей, которые срезал бы trim().
+    """
+    FeedEntry.objects.filter(user_id=user_id).delete()
+    posts = Post.objects.filter(
+        author__following__user_id=user_id
+    ).exclude(author__counters__pulled=True)
+    entries = [
+        FeedEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts.order_by(
+            '-pub_date', '-pk'
+        ).values_list('pk', 'pub_date')[:inbox_size()]
+    ]
+    FeedEntry.objects.bulk_create(entries)
+    record('push', 'written', len(entries))
+    return len(entries)
+
+
+def follow_feed_queryset(user):
+    return Post.objects.filter(author__following__user=user).for_feed()
+
+
+def merge_windows(windows, before, limit):
+    """
+    k-way слияние окон ключей (pub_date, post_id) от новых к старым.
+
+    Пост мог попасть в ящик до того, как автор перешёл порог, поэтому
+    повторы отбрасываются.
+    """
+    keys, seen = [], set()
+    for key in heapq.merge(*windows, reverse=True):
+        if key[1] in seen:
+            continue
+        seen.add(key[1])
+        keys.append(key)
+        if before is None and len(keys) > limit:
+            break
+    return keys[-(limit + 1):] if before is not None else keys
+
+
+def paginate_follow_feed(request, user, per_page=POSTS_PER_PAGE):
+    """
+    Страница ленты подписок.
+
+    Посты обычных авторов берутся из ящика, посты авторов выше порога
+    FOLLOW_FEED_PULL_THRESHOLD — отдельным индексным запросом по каждому
+    автору, после чего окна сливаются. Без ящика работает обычный join.
+    """
+    after, before = get_cursors(request)
+    if not inbox_enabled():
+        rows = keyset_window(
+            follow_feed_queryset(user), after, before, per_page
+        )
+        record('pull', 'read', len(rows))
+        return paginate_rows(rows, after, before, per_page)
+
+    windows = [keyset_window(
+        FeedEntry.objects.filter(user=user).values_list(
+            'pub_date', 'post_id'),
+        after, before, per_page, key=('pub_date', 'post_id')
+    )]
+    record('push', 'read', len(windows[0]))
+    for author_id in pulled_authors(user.pk):
+        window = keyset_window(
+            Post.objects.filter(author_id=author_id).values_list(
+                'pub_date', 'pk'),
+            after, before, per_page
+        )
+        record('pull', 'read', len(window))
+        windows.append(window)
+
+    keys = merge_windows(windows, before, per_page)
+    posts = Post.objects.for_feed().in_bulk([pk for _, pk in keys])
+    rows = [posts[pk] for _, pk in keys if pk in posts]
+    return paginate_rows(rows, after, before, per_page)
@@ -1,5 +1,7 @@
 from django.forms import ModelForm, Textarea
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import UploadedFile
+from .images import ingest
 from .models import Post, Comment
 
 
@@ -18,6 +20,12 @@ class PostForm(ModelForm):
             'text': 'html не поддерживается'
             }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return ingest(image)
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
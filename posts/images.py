@@ -0,0 +1,139 @@
+import os
+import weakref
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image, ImageOps
+
+# Форматы, которые сохраняются как есть; остальные, включая GIF,
+# перекодируются в PNG (от анимации остаётся первый кадр).
+KEEP_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+ORIENTATION = 0x0112
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 90, 'progressive': True, 'optimize': True},
+    'WEBP': {'quality': 90},
+    'PNG': {'optimize': True},
+}
+
+
+def max_bytes():
+    return getattr(settings, 'POST_IMAGE_MAX_BYTES', 20 * 1024 * 1024)
+
+
+def max_pixels():
+    return getattr(settings, 'POST_IMAGE_MAX_PIXELS', 50_000_000)
+
+
+def max_decoded_pixels():
+    return getattr(settings, 'POST_IMAGE_MAX_DECODED_PIXELS', 16_000_000)
+
+
+def max_side():
+    return getattr(settings, 'POST_IMAGE_MAX_SIDE', 2048)
+
+
+def open_upload(upload):
+    """Открывает загрузку по пути на диске, не читая её в память."""
+    if hasattr(upload, 'temporary_file_path'):
+        return Image.open(upload.temporary_file_path())
+    upload.seek(0)
+    return Image.open(upload)
+
+
+def inspect(image):
+    """
+    Отклоняет слишком большие картинки по заголовку, до декодирования.
+
+    JPEG декодируется сразу с уменьшением в 2–8 раз (draft), поэтому в
+    память попадает не больше POST_IMAGE_MAX_DECODED_PIXELS точек.
+    """
+    width, height = image.size
+    if width * height > max_pixels():
+        raise ValidationError(
+            'Изображение больше %(limit)d мегапикселей.',
+            code='too_many_pixels',
+            params={'limit': max_pixels() // 1_000_000},
+        )
+    longest = max(width, height)
+    if image.format == 'JPEG' and longest > max_side():
+        image.draft(image.mode, (
+            -(-width * max_side() // longest),
+            -(-height * max_side() // longest),
+        ))
+    width, height = image.size
+    if width * height > max_decoded_pixels():
+        raise ValidationError(
+            'Изображение слишком большое для обработки.',
+            code='too_many_pixels',
+        )
+
+
+def normalize(image):
+    """Уменьшает до POST_IMAGE_MAX_SIDE и поворачивает по EXIF."""
+    icc_profile = image.info.get('icc_profile')
+    orientation = image.getexif().get(ORIENTATION, 1)
+    limit = max_side()
+    if max(image.size) > limit:
+        # Квадратная рамка не зависит от поворота, поэтому поворачивается
+        # уже уменьшенная картинка.
+        image.thumbnail((limit, limit), Image.LANCZOS)
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    return image, icc_profile
+
+
+def ingest(upload):
+    """
+    Проверяет и нормализует загруженную картинку поста.
+
+    Возвращает новый временный файл на диске с повёрнутым, уменьшенным и
+    очищенным от EXIF изображением.
+    """
+    if upload.size > max_bytes():
+        raise ValidationError(
+            'Файл больше %(limit)d МБ.', code='file_too_large',
+            params={'limit': max_bytes() // (1024 * 1024)},
+        )
+    try:
+        with open_upload(upload) as image:
+            source_format = image.format
+            inspect(image)
+            image, icc_profile = normalize(image)
+            result = save(image, source_format, icc_profile, upload.name)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError(
+            'Загрузите правильное изображение.', code='invalid_image'
+        )
+    result.size = result.tell()
+    result.seek(0)
+    # Хранилище переносит файл на место, а закрыть его некому: запросу он
+    # не принадлежит. Закрываем при сборке мусора, не трогая перенесённый.
+    weakref.finalize(result, close_quietly, result.file)
+    return result
+
+
+def save(image, source_format, icc_profile, name):
+    """Пишет картинку во временный файл без EXIF и других метаданных."""
+    image_format = source_format if source_format in KEEP_FORMATS else 'PNG'
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    options = dict(SAVE_OPTIONS.get(image_format, {}))
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    stem = os.path.splitext(os.path.basename(name))[0]
+    result = TemporaryUploadedFile(
+        f'{stem}.{KEEP_FORMATS[image_format]}',
+        Image.MIME[image_format], 0, None
+    )
+    image.save(result, image_format, **options)
+    return result
+
+
+def close_quietly(file):
+    try:
+        file.close()
+    except FileNotFoundError:
+        pass
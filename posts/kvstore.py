@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+EMPTY_VALUE = cached_db_kvstore.EMPTY_VALUE
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """
+    Хранилище ключей sorl с LRU в памяти процесса перед общим кешем и БД.
+
+    В LRU попадают только найденные записи и живут не дольше
+    THUMBNAIL_KVSTORE_LRU_TTL секунд: миниатюру могли удалить в другом
+    процессе. prefetch() заполняет LRU для целой страницы ленты одним
+    get_many и одним запросом к БД.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lru_size(self):
+        return getattr(settings, 'THUMBNAIL_KVSTORE_LRU_SIZE', 5000)
+
+    def lru_ttl(self):
+        return getattr(settings, 'THUMBNAIL_KVSTORE_LRU_TTL', 300)
+
+    def lru_get(self, key):
+        with self.lock:
+            entry = self.lru.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.lru[key]
+                return None
+            self.lru.move_to_end(key)
+            return value
+
+    def lru_put(self, key, value):
+        with self.lock:
+            self.lru[key] = (value, time.monotonic() + self.lru_ttl())
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.lru_size():
+                self.lru.popitem(last=False)
+
+    def lru_discard(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.lru.pop(key, None)
+
+    def lru_clear(self):
+        with self.lock:
+            self.lru.clear()
+
+    def prefetch(self, keys):
+        """Загружает в LRU записи по сырым ключам (с префиксом sorl)."""
+        missing = [key for key in set(keys) if self.lru_get(key) is None]
+        if not missing:
+            return
+        found = self.cache.get_many(missing)
+        rest = [key for key in missing if key not in found]
+        if rest:
+            stored = dict(KVStoreModel.objects.filter(
+                key__in=rest
+            ).values_list('key', 'value'))
+            # Как и cached_db, запоминаем в общем кеше и отсутствие записи.
+            loaded = {key: stored.get(key, EMPTY_VALUE) for key in rest}
+            self.cache.set_many(loaded, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            found.update(loaded)
+        for key, value in found.items():
+            if value is not None and value != EMPTY_VALUE:
+                self.lru_put(key, value)
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        self.lru_clear()
+
+    def _get_raw(self, key):
+        value = self.lru_get(key)
+        if value is None:
+            value = super()._get_raw(key)
+            if value is not None:
+                self.lru_put(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self.lru_put(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        self.lru_discard(*keys)
@@ -0,0 +1,126 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново строит миниатюры всех постов с картинками в пуле процессов; '
+        'прерванный запуск продолжается с сохранённой позиции'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+            help='число процессов; 0 — строить в текущем процессе'
+        )
+        parser.add_argument('--chunk-size', type=int, default=100)
+        parser.add_argument(
+            '--nice', type=int, default=10,
+            help='на сколько понизить приоритет процессов, чтобы не мешать '
+                 'живому трафику'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.MEDIA_ROOT, '.thumbnail_backfill'),
+            help='файл с id последнего обработанного поста'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='начать с начала, не глядя на сохранённую позицию'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='удалить и построить заново уже существующие миниатюры'
+        )
+
+    def handle(self, *args, workers, chunk_size, nice, checkpoint, restart,
+               force, **options):
+        last_pk = 0 if restart else self.read_checkpoint(checkpoint)
+        posts = Post.objects.exclude(image='').exclude(image=None)
+        total = posts.filter(pk__gt=last_pk).count()
+        if last_pk:
+            self.stdout.write(f'Продолжаем после поста {last_pk}')
+        self.stdout.write(f'Постов с картинками: {total}')
+
+        started = time.monotonic()
+        processed = failed = 0
+        for chunk_end, (done, errors) in self.run(
+            posts, last_pk, workers, chunk_size, nice, force
+        ):
+            processed += done + errors
+            failed += errors
+            self.write_checkpoint(checkpoint, chunk_end)
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed else 0
+            self.stdout.write(
+                f'Обработано {processed}/{total}, с ошибкой: {failed}, '
+                f'{rate:.1f} постов/с'
+            )
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(f'Готово: {processed - failed}, с ошибкой: {failed}')
+
+    def chunks(self, posts, last_pk, chunk_size):
+        while True:
+            pks = list(posts.filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', flat=True
+            )[:chunk_size])
+            if not pks:
+                return
+            yield pks
+            last_pk = pks[-1]
+
+    def run(self, posts, last_pk, workers, chunk_size, nice, force):
+        """
+        (последний id пакета, результат) в порядке id.
+
+        Результаты выдаются по порядку пакетов, даже если процессы
+        заканчивают их вразнобой, поэтому позиция в файле никогда не
+        обгоняет необработанные посты. В работе не больше 2 × workers
+        пакетов.
+        """
+        chunks = self.chunks(posts, last_pk, chunk_size)
+        if not workers:
+            for pks in chunks:
+                yield pks[-1], thumbnails.build_chunk(pks, force)
+            return
+        # Дочерние процессы не должны унаследовать открытое соединение.
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=thumbnails.init_process,
+            initargs=(nice,)
+        ) as pool:
+            pending = deque()
+            for pks in chunks:
+                pending.append(
+                    (pks[-1], pool.submit(thumbnails.build_chunk, pks, force))
+                )
+                if len(pending) >= 2 * workers:
+                    chunk_end, future = pending.popleft()
+                    yield chunk_end, future.result()
+            while pending:
+                chunk_end, future = pending.popleft()
+                yield chunk_end, future.result()
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as checkpoint:
+                return int(checkpoint.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def write_checkpoint(self, path, last_pk):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as checkpoint:
+            checkpoint.write(str(last_pk))
+        os.replace(temporary, path)
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон основных страниц: p50/p95/p99, запросы к базе '
+        'и пропускная способность, с сохранением и сравнением базовых линий'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=benchmark.DRIVERS,
+                            default='client',
+                            help='тестовый клиент или локальный WSGI-сервер')
+        parser.add_argument('--views', default=','.join(benchmark.VIEWS),
+                            help='через запятую')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='замеряемых запросов на view')
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--cold', action='store_true',
+                            help='очищать кеш перед каждым запросом')
+        parser.add_argument('--save', metavar='NAME',
+                            help='сохранить результат как базовую линию')
+        parser.add_argument('--compare', metavar='NAME',
+                            help='сравнить с сохранённой базовой линией')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='допустимое ухудшение, %%')
+
+    def handle(self, *args, mode, views, requests, warmup, seed, cold,
+               save, compare, threshold, **options):
+        views = [view for view in views.split(',') if view]
+        unknown = set(views) - set(benchmark.VIEWS)
+        if unknown:
+            raise CommandError(f'Неизвестные view: {", ".join(unknown)}')
+        if requests < 1:
+            raise CommandError('Нужен хотя бы один запрос')
+        baseline = None
+        if compare:
+            try:
+                baseline, meta = benchmark.load_baseline(compare)
+            except FileNotFoundError:
+                raise CommandError(f'Нет базовой линии {compare!r}')
+            if (meta.get('mode'), meta.get('cold')) != (mode, cold):
+                self.stderr.write(
+                    f'Базовая линия {compare!r} снята в других условиях: '
+                    f'{meta}'
+                )
+        if settings.DEBUG:
+            self.stderr.write(
+                'DEBUG=True: Django пишет журнал запросов, замеры завышены'
+            )
+
+        try:
+            results = benchmark.run(
+                views, mode=mode, requests=requests, warmup=warmup,
+                seed=seed, cold=cold,
+            )
+        except LookupError as error:
+            raise CommandError(f'{error}: сначала запустите seed_dataset')
+        for view, result in results.items():
+            self.stdout.write(benchmark.format_result(view, result))
+
+        if save:
+            path = benchmark.save_baseline(
+                save, results, mode=mode, requests=requests, seed=seed,
+                cold=cold,
+            )
+            self.stdout.write(f'Базовая линия сохранена: {path}')
+        if baseline is not None:
+            regressions = 0
+            for line, regressed in benchmark.compare(
+                results, baseline, threshold
+            ):
+                if regressed:
+                    regressions += 1
+                    line += ' РЕГРЕССИЯ'
+                self.stdout.write(line)
+            if regressions:
+                raise CommandError(
+                    f'Хуже базовой линии {compare!r}: {regressions}'
+                )
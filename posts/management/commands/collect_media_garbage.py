@@ -0,0 +1,64 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает ссылки постов на файлы картинок и удаляет файлы, на '
+        'которые не ссылается ни один пост, вместе с их миниатюрами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='не трогать файлы моложе стольких секунд: их пост может '
+                 'быть ещё не сохранён'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, min_age, dry_run, **options):
+        field = Post._meta.get_field('image')
+        storage = field.storage
+        references = Counter(
+            Post.objects.exclude(image='').exclude(image=None)
+            .values_list('image', flat=True).iterator()
+        )
+        directory = field.upload_to.rstrip('/')
+        try:
+            names = list(storage.walk(directory))
+        except FileNotFoundError:
+            names = []
+
+        deadline = time.time() - min_age
+        removed = freed = 0
+        for name in names:
+            if references[name]:
+                continue
+            if storage.get_modified_time(name).timestamp() > deadline:
+                continue
+            # Список ссылок собран в начале: за это время файл мог получить
+            # новый пост (повторная загрузка той же картинки).
+            if Post.objects.filter(image=name).exists():
+                continue
+            size = storage.size(name)
+            if not dry_run:
+                default.kvstore.delete(ImageFile(name, storage))
+                storage.delete(name)
+            removed += 1
+            freed += size
+
+        shared = sum(1 for count in references.values() if count > 1)
+        saved = sum(count - 1 for count in references.values())
+        self.stdout.write(
+            f'Файлов: {len(names)}, используется: {len(references)}, '
+            f'общих для нескольких постов: {shared} '
+            f'(сэкономлено копий: {saved})'
+        )
+        verb = 'Будет удалено' if dry_run else 'Удалено'
+        self.stdout.write(f'{verb} файлов: {removed}, байт: {freed}')
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import thumbnail_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Ужимает каталог миниатюр до бюджета, удаляя давно не показанные '
+        'миниатюры вместе с записями sorl о них'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--budget', type=int, default=None,
+            help='байт; по умолчанию THUMBNAIL_CACHE_BUDGET'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=None,
+            help='не трогать ничьи файлы моложе стольких секунд; по '
+                 'умолчанию THUMBNAIL_CACHE_ORPHAN_MIN_AGE'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, budget, min_age, dry_run, **options):
+        if budget is None:
+            budget = thumbnail_cache.budget()
+        if budget is None:
+            raise CommandError('Не задан бюджет: --budget или '
+                               'THUMBNAIL_CACHE_BUDGET')
+        stats = thumbnail_cache.evict(
+            budget, dry_run=dry_run, min_age=min_age
+        )
+        self.stdout.write(
+            f'Файлов: {stats["files"]}, байт: {stats["bytes"]}, '
+            f'бюджет: {budget}'
+        )
+        verb = 'Будет удалено' if dry_run else 'Удалено'
+        self.stdout.write(
+            f'{verb} ничьих файлов: {stats["orphans"]}, миниатюр картинок: '
+            f'{stats["sources"]}, байт: {stats["freed"]}'
+        )
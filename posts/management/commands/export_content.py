@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = (
+        'Построчно выгружает группы, посты, комментарии и подписки в JSONL '
+        'или CSV, в формате import_content'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='файл или - для stdout')
+        parser.add_argument('--format', choices=export.RENDERERS)
+        parser.add_argument('--kinds', default='',
+                            help='через запятую: group,post,comment,follow')
+        parser.add_argument('--chunk-size', type=int,
+                            default=export.CHUNK_SIZE)
+
+    def handle(self, *args, path, format, kinds, chunk_size, **options):
+        try:
+            kinds = export.parse_kinds(kinds)
+        except ValueError as error:
+            raise CommandError(error)
+        if format is None:
+            format = 'csv' if path.endswith('.csv') else 'jsonl'
+        render, _ = export.RENDERERS[format]
+        lines = render(export.rows(kinds, chunk_size))
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            output.writelines(lines)
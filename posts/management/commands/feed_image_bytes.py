@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+
+from posts import thumbnails
+from posts.models import Post
+from posts.pagination import POSTS_PER_PAGE
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает объём картинок одной страницы ленты: самый широкий JPEG, '
+        'который загрузил бы <img> без srcset, против варианта из srcset, '
+        'который выберет браузер'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--width', type=int, default=375,
+            help='ширина карточки на экране в CSS-пикселях'
+        )
+        parser.add_argument('--dpr', type=float, default=2)
+        parser.add_argument('--family', default='card')
+
+    def handle(self, *args, width, dpr, family, **options):
+        # Считаются только готовые миниатюры: команда ничего не строит.
+        posts = Post.objects.exclude(image='').filter(
+            thumbnails_ready=True
+        ).order_by('-pub_date', '-pk')[:POSTS_PER_PAGE]
+        needed = width * dpr
+        variants = thumbnails.variants(family)
+        widest = variants.get('JPEG', [None])[-1]
+        totals = {'без srcset': 0}
+        for post in posts:
+            if widest is not None:
+                totals['без srcset'] += self.size(post, widest[2])
+            for image_format, items in variants.items():
+                chosen = next(
+                    (item for item in items if item[0] >= needed), items[-1]
+                )
+                key = f'{image_format.lower()} {chosen[0]}w'
+                totals[key] = totals.get(key, 0) + self.size(post, chosen[2])
+        self.stdout.write(
+            f'Постов с картинками на странице: {len(posts)}; '
+            f'нужна ширина {needed:g}px'
+        )
+        baseline = totals['без srcset']
+        for name, size in totals.items():
+            share = size / baseline if baseline else 0
+            self.stdout.write(f'{name}: {size} байт ({share:.0%})')
+
+    def size(self, post, preset):
+        thumbnail = thumbnails.lookup(post.image, preset)
+        if thumbnail is None:
+            return 0
+        return default.storage.size(thumbnail.name)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts import follow_feed
+from posts.models import UserCounter
+
+
+class Command(BaseCommand):
+    help = 'Показывает, сколько строк прочитала и записала каждая стратегия'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true')
+
+    def handle(self, *args, reset, **options):
+        threshold = follow_feed.pull_threshold()
+        if threshold is None:
+            pulled = 0
+        else:
+            pulled = UserCounter.objects.filter(
+                followers_count__gt=threshold
+            ).count()
+        self.stdout.write(f'Порог подписчиков: {threshold}')
+        self.stdout.write(f'Авторов, читаемых при показе: {pulled}')
+        for (strategy, operation), rows in follow_feed.stats().items():
+            self.stdout.write(f'{strategy} {operation}: {rows}')
+        if reset:
+            follow_feed.reset_stats()
@@ -0,0 +1,353 @@
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import follow_feed, page_cache
+from posts.models import (Comment, FeedEntry, Follow, Group, Post,
+                          ThumbnailJob, User, UserCounter)
+
+KINDS = ('post', 'comment', 'follow')
+
+
+class RowError(Exception):
+    pass
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Отключает auto_now_add, чтобы сохранить даты из файла."""
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def read_jsonl(stream):
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError as error:
+                yield number, RowError(f'не JSON: {error}')
+
+
+def read_csv(stream):
+    for number, row in enumerate(csv.DictReader(stream), 2):
+        yield number, {key: value for key, value in row.items() if value}
+
+
+def last_post_id():
+    """
+    Последний выданный id поста.
+
+    В SQLite это счётчик AUTOINCREMENT, а не наибольший id: id удалённых
+    постов не должны достаться новым, на них могут ссылаться ключи кеша и
+    внешние ссылки.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT seq FROM sqlite_sequence WHERE name = %s',
+                [Post._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
+    return Post.objects.aggregate(last=models.Max('pk'))['last'] or 0
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует группы, посты, комментарии и подписки из JSONL или CSV '
+        'пакетами bulk_create'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл или - для stdin')
+        parser.add_argument('--format', choices=('jsonl', 'csv'))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--transaction-size', type=int, default=10000,
+            help='строк в одной транзакции'
+        )
+        parser.add_argument(
+            '--skip-inboxes', action='store_true',
+            help='не заполнять ящики ленты подписок; после импорта '
+                 'запустите rebuild_follow_feeds'
+        )
+
+    def handle(self, *args, path, format, batch_size, transaction_size,
+               skip_inboxes, **options):
+        if format is None:
+            format = 'csv' if path.endswith('.csv') else 'jsonl'
+        reader = read_csv if format == 'csv' else read_jsonl
+        self.batch_size = batch_size
+        self.inboxes = follow_feed.inbox_enabled() and not skip_inboxes
+        self.users = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+        # Ссылки из файла на импортированные посты: ref -> id.
+        self.refs = {}
+        self.imported = dict.fromkeys(('group',) + KINDS, 0)
+        self.skipped = 0
+
+        stream = sys.stdin if path == '-' else open(path, newline='')
+        fields = (
+            Post._meta.get_field('pub_date'),
+            Comment._meta.get_field('created'),
+        )
+        started = time.monotonic()
+        try:
+            rows = reader(stream)
+            with explicit_dates(*fields):
+                while True:
+                    chunk = list(islice(rows, transaction_size))
+                    if not chunk:
+                        break
+                    with transaction.atomic():
+                        self.import_chunk(chunk)
+                    self.report(started)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(
+            ', '.join(f'{kind}: {count}'
+                      for kind, count in self.imported.items())
+            + f'; пропущено строк: {self.skipped}'
+        )
+
+    def report(self, started):
+        total = sum(self.imported.values()) + self.skipped
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(f'Обработано строк: {total}, {rate:.0f} строк/с')
+
+    def import_chunk(self, chunk):
+        self.pending = {kind: [] for kind in KINDS}
+        self.touched = {
+            'users': set(), 'posts': [], 'commented': set(),
+            'follows': set(), 'groups': set(),
+        }
+        for number, row in chunk:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                self.add(row)
+            except RowError as error:
+                self.skipped += 1
+                self.stderr.write(f'Строка {number}: {error}')
+        for kind in KINDS:
+            self.flush(kind)
+        self.reconcile()
+
+    def user_id(self, row, field):
+        username = row.get(field)
+        if username not in self.users:
+            raise RowError(f'нет пользователя {username!r}')
+        return self.users[username]
+
+    def date(self, row, field):
+        value = row.get(field)
+        if not value:
+            return timezone.now()
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise RowError(f'не дата: {value!r}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def add(self, row):
+        kind = row.get('type')
+        if kind == 'group':
+            self.add_group(row)
+            return
+        if kind not in KINDS:
+            raise RowError(f'неизвестный тип {kind!r}')
+        if kind == 'post':
+            group_id = None
+            if row.get('group'):
+                if row['group'] not in self.groups:
+                    raise RowError(f'нет группы {row["group"]!r}')
+                group_id = self.groups[row['group']]
+            post = Post(
+                author_id=self.user_id(row, 'author'), group_id=group_id,
+                text=row.get('text') or '', image=row.get('image') or '',
+                pub_date=self.date(row, 'pub_date'),
+            )
+            post.ref = row.get('ref')
+            self.queue('post', post)
+        elif kind == 'comment':
+            if row.get('post_ref'):
+                if row['post_ref'] not in self.refs:
+                    self.flush('post')
+                post_id = self.refs.get(row['post_ref'])
+            else:
+                post_id = row.get('post')
+            if not str(post_id or '').isdigit():
+                raise RowError('не найден пост комментария')
+            self.queue('comment', Comment(
+                post_id=int(post_id), author_id=self.user_id(row, 'author'),
+                text=row.get('text') or '',
+                created=self.date(row, 'created'),
+            ))
+        else:
+            user_id = self.user_id(row, 'user')
+            author_id = self.user_id(row, 'author')
+            if user_id == author_id:
+                raise RowError('подписка на самого себя')
+            self.queue('follow', Follow(user_id=user_id, author_id=author_id))
+
+    def add_group(self, row):
+        """Групп мало: недостающие создаются сразу, без пакетов."""
+        slug = row.get('slug')
+        if not slug or not row.get('title'):
+            raise RowError('у группы нет slug или title')
+        if slug not in self.groups:
+            self.groups[slug] = Group.objects.create(
+                slug=slug, title=row['title'],
+                description=row.get('description'),
+            ).pk
+            self.imported['group'] += 1
+
+    def queue(self, kind, obj):
+        # --batch-size ограничивает строки одного bulk_create; на запросы
+        # их делит сам Django с учётом лимитов базы (в SQLite — 999
+        # параметров).
+        self.pending[kind].append(obj)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush(kind)
+
+    def flush(self, kind):
+        objs, self.pending[kind] = self.pending[kind], []
+        if objs:
+            getattr(self, f'flush_{kind}s')(objs)
+
+    def flush_posts(self, posts):
+        if not connection.features.can_return_ids_from_bulk_insert:
+            # SQLite не возвращает id после bulk_create: назначаем их сами.
+            # Внутри транзакции с записью другие писатели ждут её конца.
+            for offset, post in enumerate(posts, last_post_id() + 1):
+                post.pk = offset
+        Post.objects.bulk_create(posts)
+        ThumbnailJob.objects.bulk_create(
+            [ThumbnailJob(post_id=post.pk) for post in posts if post.image]
+        )
+        for post in posts:
+            if post.ref:
+                self.refs[post.ref] = post.pk
+            self.touched['users'].add(post.author_id)
+            self.touched['groups'].add(post.group_id)
+        self.touched['posts'] += [
+            (post.pk, post.author_id, post.pub_date) for post in posts
+        ]
+        self.imported['post'] += len(posts)
+
+    def flush_comments(self, comments):
+        existing = set(Post.objects.filter(
+            pk__in={comment.post_id for comment in comments}
+        ).values_list('pk', flat=True))
+        valid = [
+            comment for comment in comments if comment.post_id in existing
+        ]
+        for comment in comments:
+            if comment.post_id not in existing:
+                self.skipped += 1
+                self.stderr.write(f'Нет поста {comment.post_id}')
+        Comment.objects.bulk_create(valid)
+        self.touched['commented'].update(
+            comment.post_id for comment in valid
+        )
+        self.imported['comment'] += len(valid)
+
+    def flush_follows(self, follows):
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        for follow in follows:
+            self.touched['users'].update((follow.user_id, follow.author_id))
+            self.touched['follows'].add((follow.user_id, follow.author_id))
+        self.imported['follow'] += len(follows)
+
+    def reconcile(self):
+        """
+        Делает за пакет то, что для одиночных записей делают сигналы.
+
+        bulk_create сигналов не шлёт: счётчики, ящики ленты подписок и кеш
+        страниц обновляются здесь. Поисковый индекс заполняют триггеры
+        SQLite, миниатюры строит process_thumbnail_jobs.
+        """
+        touched = self.touched
+        commented = touched['commented']
+        if commented:
+            Post.objects.filter(pk__in=commented).update(
+                comment_count=models.Subquery(
+                    Comment.objects.filter(post=models.OuterRef('pk'))
+                    .order_by().values('post')
+                    .annotate(n=models.Count('pk')).values('n')
+                )
+            )
+        for user_id in touched['users']:
+            UserCounter.recount(user_id)
+        follow_feed.mark_pulled(*touched['users'])
+
+        readers = {user_id for user_id, _ in touched['follows']}
+        if self.inboxes:
+            readers |= self.push(touched['posts'])
+            for user_id, author_id in touched['follows']:
+                follow_feed.backfill(user_id, author_id)
+
+        usernames = dict(
+            User.objects.filter(pk__in=touched['users'])
+            .values_list('pk', 'username')
+        )
+        slugs = Group.objects.filter(
+            pk__in=touched['groups'] - {None}
+        ).values_list('slug', flat=True)
+        commented_authors = dict(Post.objects.filter(
+            pk__in=commented
+        ).values_list('author_id', 'author__username').distinct())
+        UserCounter.touch(*touched['users'], *commented_authors)
+        page_cache.bump(
+            'index',
+            *(f'profile:{name}' for name in usernames.values()),
+            *(f'profile:{name}' for name in commented_authors.values()),
+            *(f'author:{user_id}' for user_id in usernames),
+            *(f'group:{slug}' for slug in slugs),
+            *(f'post:{post_id}' for post_id in commented),
+            *(f'feed:{user_id}' for user_id in readers),
+        )
+
+    def push(self, posts):
+        """Раскладывает импортированные посты по ящикам подписчиков."""
+        by_author = {}
+        for pk, author_id, pub_date in posts:
+            by_author.setdefault(author_id, []).append((pk, pub_date))
+        readers = set()
+        for author_id, author_posts in by_author.items():
+            if follow_feed.is_pulled(author_id):
+                continue
+            followers = list(Follow.objects.filter(
+                author_id=author_id
+            ).values_list('user_id', flat=True))
+            FeedEntry.objects.bulk_create(
+                [
+                    FeedEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+                    for user_id in followers for pk, pub_date in author_posts
+                ],
+                ignore_conflicts=True,
+            )
+            follow_feed.record(
+                'push', 'written', len(followers) * len(author_posts)
+            )
+            readers.update(followers)
+        follow_feed.trim(readers)
+        return readers
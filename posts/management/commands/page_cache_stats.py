@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts import page_cache
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кеша страниц по видам тегов'
+
+    def handle(self, *args, **options):
+        for (kind, outcome), count in page_cache.stats().items():
+            self.stdout.write(f'{kind} {outcome}: {count}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры для постов из очереди заданий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, limit, **options):
+        done, failed = thumbnails.drain(limit)
+        self.stdout.write(f'Готово: {done}, с ошибкой: {failed}')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts import follow_feed
+from posts.models import Follow
+
+
+class Command(BaseCommand):
+    help = 'Заново заполняет ящики ленты подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*')
+
+    def handle(self, *args, usernames, **options):
+        users = Follow.objects.order_by('user_id').values_list(
+            'user_id', flat=True
+        ).distinct()
+        if usernames:
+            users = users.filter(user__username__in=usernames)
+        total = 0
+        for user_id in users.iterator():
+            total += follow_feed.rebuild(user_id)
+        self.stdout.write(f'Записей в ящиках: {total}')
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from posts.search import FTS_TABLE, fts_available
+
+
+class Command(BaseCommand):
+    help = 'Заново строит полнотекстовый индекс постов частями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, chunk_size, **options):
+        if not fts_available():
+            raise CommandError('Полнотекстовый поиск работает только в SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')"
+            )
+            last_id, total = 0, 0
+            while True:
+                with transaction.atomic():
+                    cursor.execute(
+                        'SELECT MAX(id), COUNT(*) FROM ('
+                        'SELECT id FROM posts_post WHERE id > %s '
+                        'ORDER BY id LIMIT %s)',
+                        [last_id, chunk_size]
+                    )
+                    chunk_end, count = cursor.fetchone()
+                    if not count:
+                        break
+                    cursor.execute(
+                        f'INSERT INTO {FTS_TABLE}(rowid, text) '
+                        'SELECT id, text FROM posts_post '
+                        'WHERE id > %s AND id <= %s',
+                        [last_id, chunk_end]
+                    )
+                last_id, total = chunk_end, total + count
+                self.stdout.write(f'Проиндексировано постов: {total}')
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"
+            )
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from posts.models import Comment, Follow, Post, User, UserCounter
+
+
+def count_of(model, field):
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')})
+        .order_by().values(field).annotate(n=models.Count('pk'))
+        .values('n')
+    ), 0)
+
+
+def batches(queryset, batch_size):
+    last_pk = 0
+    while True:
+        batch = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1][0]
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счётчики постов, комментариев и подписок с данными'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        fixed_posts = self.reconcile_posts(batch_size)
+        fixed_users = self.reconcile_users(batch_size)
+        self.stdout.write(
+            f'Исправлено постов: {fixed_posts}, '
+            f'пользователей: {fixed_users}'
+        )
+
+    def reconcile_posts(self, batch_size):
+        fixed = 0
+        posts = Post.objects.annotate(
+            actual=count_of(Comment, 'post')
+        ).values_list('pk', 'comment_count', 'actual')
+        for batch in batches(posts, batch_size):
+            with transaction.atomic():
+                for pk, stored, actual in batch:
+                    if stored != actual:
+                        Post.objects.filter(pk=pk).update(
+                            comment_count=actual
+                        )
+                        fixed += 1
+        return fixed
+
+    def reconcile_users(self, batch_size):
+        fixed = 0
+        fields = ('posts_count', 'followers_count', 'following_count')
+        users = User.objects.annotate(
+            posts_count=count_of(Post, 'author'),
+            followers_count=count_of(Follow, 'author'),
+            following_count=count_of(Follow, 'user'),
+        ).values_list('pk', *fields)
+        for batch in batches(users, batch_size):
+            stored = UserCounter.objects.in_bulk([row[0] for row in batch])
+            with transaction.atomic():
+                for pk, *actual in batch:
+                    actual = dict(zip(fields, actual))
+                    counters = stored.get(pk)
+                    if counters and all(
+                        getattr(counters, field) == value
+                        for field, value in actual.items()
+                    ):
+                        continue
+                    UserCounter.objects.update_or_create(
+                        user_id=pk, defaults=actual
+                    )
+                    fixed += 1
+        return fixed
@@ -0,0 +1,222 @@
+import itertools
+import json
+import os
+import random
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from posts import follow_feed, page_cache
+from posts.models import Follow, User
+from posts.storage import post_images
+
+WORDS = (
+    'дом колёса дорога лес озеро ночь костёр карта маршрут вид утро закат '
+    'печка крыша окно трасса стоянка гора река поле город друзья осень зима '
+    'весна лето дождь снег солнце ветер кофе ужин фото ремонт мотор колея'
+).split()
+
+
+def zipf_weights(count, alpha):
+    """Веса 1 / rank^alpha: немногие элементы получают большую часть."""
+    return list(itertools.accumulate(
+        1 / rank ** alpha for rank in range(1, count + 1)
+    ))
+
+
+def pareto_count(rng, mean, alpha, limit):
+    """Целое с тяжёлым хвостом и примерно заданным средним."""
+    scale = mean * (alpha - 1) / alpha
+    return min(int(scale * rng.paretovariate(alpha)), limit)
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует воспроизводимый набор данных для нагрузочных тестов: '
+        'пользователей, группы, посты с картинками, комментарии и подписки '
+        'со степенным распределением'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=float, default=3,
+                            help='в среднем комментариев на пост')
+        parser.add_argument('--follows', type=float, default=20,
+                            help='в среднем подписок на пользователя')
+        parser.add_argument('--images', type=float, default=0.2,
+                            help='доля постов с картинкой')
+        parser.add_argument('--image-pool', type=int, default=20,
+                            help='разных картинок на весь набор')
+        parser.add_argument('--alpha', type=float, default=1.1,
+                            help='показатель степенного распределения')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--keep', metavar='PATH',
+                            help='сохранить сгенерированный JSONL')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['posts'] < 1:
+            raise CommandError('Нужно хотя бы 2 пользователя и 1 пост')
+        if User.objects.filter(
+            username__startswith=f'{options["prefix"]}_'
+        ).exists():
+            raise CommandError(
+                f'Набор с префиксом {options["prefix"]!r} уже есть'
+            )
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        usernames = self.create_users()
+        images = self.create_images()
+
+        if options['keep']:
+            path = options['keep']
+        else:
+            handle, path = tempfile.mkstemp(suffix='.jsonl')
+            os.close(handle)
+        try:
+            with open(path, 'w', encoding='utf-8') as output:
+                for row in self.rows(usernames, images):
+                    output.write(json.dumps(row, ensure_ascii=False) + '\n')
+            # Счётчики, задания миниатюр и сброс кеша делает импорт: набор
+            # проходит тот же путь, что и настоящий.
+            call_command(
+                'import_content', path, format='jsonl',
+                batch_size=options['batch_size'], skip_inboxes=True,
+                stdout=self.stdout, stderr=self.stderr,
+            )
+        finally:
+            if not options['keep']:
+                os.remove(path)
+        self.fill_inboxes()
+
+    def fill_inboxes(self):
+        """
+        Ящики ленты подписок заполняются после импорта, по разу на читателя.
+
+        Раскладка каждого пакета постов по подписчикам популярных авторов
+        писала бы в разы больше строк, чем потом оставил бы trim().
+        """
+        if not follow_feed.inbox_enabled():
+            return
+        readers = Follow.objects.filter(
+            user__username__startswith=f'{self.options["prefix"]}_'
+        ).order_by('user_id').values_list('user_id', flat=True).distinct()
+        total = 0
+        for user_id in readers.iterator():
+            total += follow_feed.rebuild(user_id)
+        page_cache.bump(*(f'feed:{user_id}' for user_id in readers))
+        self.stdout.write(f'Записей в ящиках: {total}')
+
+    def create_users(self):
+        prefix, count = self.options['prefix'], self.options['users']
+        # Один хеш на всех: иначе PBKDF2 занимал бы большую часть времени.
+        password = make_password(prefix)
+        users = [
+            User(username=f'{prefix}_{number}', password=password,
+                 first_name=self.rng.choice(WORDS).title())
+            for number in range(count)
+        ]
+        User.objects.bulk_create(users)
+        self.stdout.write(f'Пользователей: {count}, пароль: {prefix}')
+        return [user.username for user in users]
+
+    def create_images(self):
+        names = []
+        for number in range(self.options['image_pool']):
+            image = Image.new('RGB', (1280, 960), self.color())
+            draw = ImageDraw.Draw(image)
+            for _ in range(12):
+                x, y = self.rng.randrange(1280), self.rng.randrange(960)
+                draw.ellipse(
+                    (x, y, x + self.rng.randrange(50, 400),
+                     y + self.rng.randrange(50, 400)),
+                    fill=self.color(),
+                )
+            buffer = BytesIO()
+            image.save(buffer, 'JPEG', quality=85)
+            names.append(post_images.save(
+                f'posts/seed_{number}.jpg', ContentFile(buffer.getvalue())
+            ))
+        return names
+
+    def color(self):
+        return tuple(self.rng.randrange(256) for _ in range(3))
+
+    def text(self, low, high):
+        return ' '.join(
+            self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high))
+        ).capitalize()
+
+    def rows(self, usernames, images):
+        options, rng = self.options, self.rng
+        prefix, alpha = options['prefix'], options['alpha']
+        groups = [f'{prefix}-group-{n}' for n in range(options['groups'])]
+        for slug in groups:
+            yield {'type': 'group', 'slug': slug, 'title': self.text(1, 3),
+                   'description': self.text(5, 15)}
+
+        # Популярность авторов и групп по закону Ципфа: кто чаще пишет, на
+        # того чаще подписываются.
+        popularity = zipf_weights(len(usernames), alpha)
+        group_weights = zipf_weights(len(groups), alpha) if groups else None
+        for username in usernames:
+            wanted = pareto_count(
+                rng, options['follows'], 1 + alpha, len(usernames) - 1
+            )
+            authors = set(rng.choices(
+                usernames, cum_weights=popularity, k=wanted
+            )) - {username}
+            for author in sorted(authors):
+                yield {'type': 'follow', 'user': username, 'author': author}
+
+        now = timezone.now()
+        span = timedelta(days=options['days'])
+        total = options['posts']
+        comments = []
+        for number in range(total):
+            author = rng.choices(usernames, cum_weights=popularity)[0]
+            pub_date = now - span + span * (number + 1) / total
+            post = {
+                'type': 'post', 'ref': f'{prefix}-{number}',
+                'author': author, 'text': self.text(5, 60),
+                'pub_date': pub_date.isoformat(),
+            }
+            if groups and rng.random() < 0.6:
+                post['group'] = rng.choices(
+                    groups, cum_weights=group_weights
+                )[0]
+            if images and rng.random() < options['images']:
+                post['image'] = rng.choice(images)
+            yield post
+            # Обсуждения с тяжёлым хвостом: у большинства постов пара
+            # комментариев, у немногих — сотни.
+            for offset in range(pareto_count(
+                rng, options['comments'], 1 + alpha, 1000
+            )):
+                comments.append({
+                    'type': 'comment', 'post_ref': post['ref'],
+                    'author': rng.choices(
+                        usernames, cum_weights=popularity
+                    )[0],
+                    'text': self.text(2, 25),
+                    'created': min(
+                        pub_date + timedelta(minutes=offset + 1), now
+                    ).isoformat(),
+                })
+            # Комментарии идут после пакета постов: ссылка на ещё не
+            # записанный пост заставила бы импорт сбросить пакет раньше.
+            if (number + 1) % options['batch_size'] == 0:
+                yield from comments
+                comments = []
+        yield from comments
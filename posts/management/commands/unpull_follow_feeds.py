@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts import follow_feed, page_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Раскладывает по ящикам посты авторов, у которых подписчиков снова '
+        'не больше FOLLOW_FEED_PULL_THRESHOLD'
+    )
+
+    def handle(self, *args, **options):
+        authors = list(
+            follow_feed.unpull_candidates().values_list('user_id', flat=True)
+        )
+        done = 0
+        for author_id in authors:
+            readers = follow_feed.unpull(author_id)
+            if readers is None:
+                continue
+            page_cache.bump(*(f'feed:{user_id}' for user_id in readers))
+            done += 1
+        self.stdout.write(f'Авторов разложено по ящикам: {done}')
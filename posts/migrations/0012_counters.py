@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:58
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    UserCounter = apps.get_model('posts', 'UserCounter')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    def count(model, field):
+        return Coalesce(models.Subquery(
+            model.objects.filter(**{field: models.OuterRef('pk')})
+            .order_by().values(field).annotate(n=models.Count('pk'))
+            .values('n')
+        ), 0)
+
+    Post.objects.update(comment_count=count(Comment, 'post'))
+    users = User.objects.annotate(
+        n_posts=count(Post, 'author'),
+        n_followers=count(Follow, 'author'),
+        n_following=count(Follow, 'user'),
+    ).values_list('pk', 'n_posts', 'n_followers', 'n_following')
+    UserCounter.objects.bulk_create(
+        UserCounter(
+            user_id=pk, posts_count=n_posts,
+            followers_count=n_followers, following_count=n_following
+        )
+        for pk, n_posts, n_followers, n_following in users.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_auto_20200831_2051'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('posts_count', models.PositiveIntegerField(default=0)),
+                ('followers_count', models.PositiveIntegerField(default=0)),
+                ('following_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
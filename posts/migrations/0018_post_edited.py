@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:29
+
+from django.db import migrations, models
+
+
+def fill_edited(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(edited=models.F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_post_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='edited',
+            field=models.DateTimeField(auto_now=True, verbose_name='date edited'),
+        ),
+        migrations.RunPython(fill_edited, migrations.RunPython.noop),
+    ]
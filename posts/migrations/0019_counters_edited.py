@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:08
+
+from django.db import migrations, models
+
+
+def fill_edited(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    UserCounter = apps.get_model('posts', 'UserCounter')
+    UserCounter.objects.update(edited=models.Subquery(
+        Post.objects.filter(author=models.OuterRef('user'))
+        .order_by('-edited').values('edited')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_edited'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercounter',
+            name='changes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usercounter',
+            name='edited',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='date edited'),
+        ),
+        migrations.RunPython(fill_edited, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_counters_pulled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnails_version',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
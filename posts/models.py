@@ -1,6 +1,9 @@
 import textwrap
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from .storage import post_images
 
 User = get_user_model()
 
@@ -14,17 +17,53 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Всё, что нужно карточке поста, одним запросом."""
+        return self.select_related('author', 'group').only(
+            'text', 'pub_date', 'edited', 'image', 'thumbnails_ready',
+            'thumbnails_version', 'comment_count',
+            'author', 'author__username',
+            'author__first_name', 'author__last_name',
+            'group', 'group__slug', 'group__title',
+        )
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField('date published', auto_now_add=True)
+    edited = models.DateTimeField('date edited', auto_now=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='posts')
     group = models.ForeignKey(Group, on_delete=models.SET_NULL, blank=True,
                               null=True, related_name='posts')
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/', storage=post_images,
+                              blank=True, null=True)
+    thumbnails_ready = models.BooleanField(default=False, editable=False)
+    # thumbnails.presets_version(), с которой строились миниатюры.
+    thumbnails_version = models.CharField(
+        max_length=32, blank=True, editable=False
+    )
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_date'
+                ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_date'
+                ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_date'
+                ),
+        ]
 
     def __str__(self):
         short_text = textwrap.shorten(self.text, width=20, placeholder="...")
@@ -45,6 +84,12 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['created']
+        indexes = [
+            models.Index(
+                fields=['post', 'created'],
+                name='comment_post_created'
+                ),
+        ]
 
     def __str__(self):
         short_text = textwrap.shorten(self.text, width=20, placeholder='...')
@@ -70,3 +115,118 @@ class Follow(models.Model):
                 name='unique_follow'
                 )
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user'
+                ),
+        ]
+
+
+class UserCounter(models.Model):
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name='counters'
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Время последнего изменения постов автора, комментариев к ним и их
+    # миниатюр и число таких изменений: по ним строится версия профиля.
+    edited = models.DateTimeField('date edited', null=True, blank=True)
+    changes = models.PositiveIntegerField(default=0)
+    # Посты автора читаются при показе ленты подписок, а не раскладываются
+    # по ящикам; см. follow_feed.mark_pulled().
+    pulled = models.BooleanField(default=False)
+
+    def __str__(self):
+        return (f'Counters. User: {self.user_id}, Posts: {self.posts_count}, '
+                f'Followers: {self.followers_count}, '
+                f'Following: {self.following_count}')
+
+    @classmethod
+    def actual(cls, user_id):
+        return {
+            'posts_count': Post.objects.filter(author_id=user_id).count(),
+            'followers_count': Follow.objects.filter(
+                author_id=user_id).count(),
+            'following_count': Follow.objects.filter(
+                user_id=user_id).count(),
+        }
+
+    @classmethod
+    def recount(cls, user_id):
+        counters, _ = cls.objects.update_or_create(
+            user_id=user_id, defaults=cls.actual(user_id)
+        )
+        return counters
+
+    @classmethod
+    def get_for(cls, user):
+        try:
+            return cls.objects.get(user=user)
+        except cls.DoesNotExist:
+            return cls.recount(user.pk)
+
+    @classmethod
+    def touch(cls, *user_ids):
+        """Отмечает изменение постов авторов: меняет версию их профилей."""
+        if user_ids:
+            cls.objects.filter(user_id__in=user_ids).update(
+                edited=timezone.now(), changes=models.F('changes') + 1
+            )
+
+    @classmethod
+    def bump(cls, user_id, field, delta):
+        updated = cls.objects.filter(
+            user_id=user_id, **{f'{field}__gte': -delta}
+        ).update(**{field: models.F(field) + delta})
+        # Строки нет (или счётчик разошёлся с данными) — пересчитываем.
+        # При удалении пользователя строка уже удалена каскадом: пропускаем.
+        if not updated and (
+            delta > 0 or cls.objects.filter(user_id=user_id).exists()
+        ):
+            cls.recount(user_id)
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='inbox'
+    )
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name='inbox_entries'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_feed_entry'
+                )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='feed_entry_user_date'
+                )
+        ]
+
+    def __str__(self):
+        return (f'FeedEntry. User: {self.user_id}, Post: {self.post_id}, '
+                f'Date: {self.pub_date}')
+
+
+class ThumbnailJob(models.Model):
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name='thumbnail_jobs'
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ['created']
+
+    def __str__(self):
+        return (f'ThumbnailJob. Post: {self.post_id}, '
+                f'Created: {self.created}, Attempts: {self.attempts}')
@@ -0,0 +1,228 @@
+import hashlib
+import random
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import follow_feed
+from .models import Follow
+
+TAG_KEY = 'page_cache:tag:{}'
+PAGE_KEY = 'page_cache:page:{}'
+LOCK_KEY = 'page_cache:lock:{}'
+STATS_KEY = 'page_cache:stats:{}:{}'
+STATS_KINDS = ('index', 'group', 'profile', 'feed')
+OUTCOMES = ('hit', 'stale', 'miss')
+
+
+def new_version():
+    """Поколение тега: уникальный токен и время, когда тег сбросили."""
+    return uuid.uuid4().hex, time.time()
+
+
+def tag_versions(tags):
+    """Текущие поколения тегов; отсутствующим в кеше назначаются новые."""
+    keys = [TAG_KEY.format(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, tag_timeout())
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump(*tags):
+    """Сбрасывает все страницы, зависящие от тегов."""
+    if tags:
+        cache.set_many(
+            {TAG_KEY.format(tag): new_version() for tag in set(tags)},
+            tag_timeout()
+        )
+
+
+def shared_cache():
+    """
+    Виден ли кеш всем процессам.
+
+    Теги сбрасывают и другие воркеры, и команды, и фоновые обработчики;
+    в кеше в памяти процесса их сбросы не видны.
+    """
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def local_ttl():
+    return getattr(settings, 'PAGE_CACHE_LOCAL_TTL', 20)
+
+
+def tag_timeout():
+    """
+    Сколько хранится поколение тега: в общем кеше — бессрочно, в кеше
+    процесса — local_ttl() секунд. Иначе ETag и Last-Modified по старому
+    поколению совпадали бы, пока живёт процесс, не заметивший сброса.
+    """
+    return None if shared_cache() else local_ttl()
+
+
+def ttl():
+    """
+    Срок свежести страницы со случайным разбросом ±PAGE_CACHE_JITTER.
+
+    С кешем в памяти процесса срок не больше PAGE_CACHE_LOCAL_TTL: дольше
+    страница могла бы пережить сброс, сделанный в другом процессе.
+    """
+    jitter = getattr(settings, 'PAGE_CACHE_JITTER', 0.1)
+    base = getattr(settings, 'PAGE_CACHE_TTL', 600)
+    if not shared_cache():
+        base = min(base, local_ttl())
+    return base * random.uniform(1 - jitter, 1 + jitter)
+
+
+def grace():
+    return getattr(settings, 'PAGE_CACHE_GRACE', 30)
+
+
+def acquire(key):
+    """Аренда на пересчёт страницы: достаётся только одному запросу."""
+    timeout = getattr(settings, 'PAGE_CACHE_LOCK_TIMEOUT', 10)
+    return cache.add(LOCK_KEY.format(key), 1, timeout)
+
+
+def release(key):
+    cache.delete(LOCK_KEY.format(key))
+
+
+def index_tags(request):
+    return ['index', 'groups']
+
+
+def group_tags(request, slug):
+    return [f'group:{slug}', 'groups']
+
+
+def profile_tags(request, username):
+    return [f'profile:{username}', 'groups']
+
+
+def follow_tags(request):
+    user_id = request.user.pk
+    return [f'feed:{user_id}', 'groups'] + [
+        f'author:{author_id}'
+        for author_id in follow_feed.pulled_authors(user_id)
+    ]
+
+
+def post_tags(post, group_slugs=()):
+    """Теги страниц, на которых показывается карточка поста."""
+    tags = [
+        'index', f'post:{post.pk}',
+        f'profile:{post.author.username}', f'author:{post.author_id}',
+    ]
+    tags += [f'group:{slug}' for slug in group_slugs if slug]
+    if not follow_feed.is_pulled(post.author_id):
+        followers = Follow.objects.filter(
+            author_id=post.author_id
+        ).values_list('user_id', flat=True)
+        tags += [f'feed:{user_id}' for user_id in followers]
+    return tags
+
+
+def viewer_id(request, per_user=True):
+    """Id зрителя для ключей и ETag; 0 для анонимов и общих страниц."""
+    if per_user and request.user.is_authenticated:
+        return request.user.pk
+    return 0
+
+
+def page_key(request, per_user=True):
+    raw = f'{request.get_full_path()}|{viewer_id(request, per_user)}'
+    return PAGE_KEY.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def stale_since(entry, versions, now):
+    """С какого момента запись устарела, или None, если она свежая."""
+    changed = [
+        bumped_at for (token, bumped_at), (old_token, _)
+        in zip(versions, entry['versions']) if token != old_token
+    ]
+    if changed:
+        return min(max(changed), now)
+    if now >= entry['expires']:
+        return entry['expires']
+    return None
+
+
+def record(tag, outcome):
+    key = STATS_KEY.format(tag.split(':', 1)[0], outcome)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def stats():
+    keys = {
+        (kind, outcome): STATS_KEY.format(kind, outcome)
+        for kind in STATS_KINDS for outcome in OUTCOMES
+    }
+    values = cache.get_many(keys.values())
+    return {pair: values.get(key, 0) for pair, key in keys.items()}
+
+
+def cache_page_tagged(get_tags, per_user=True):
+    """
+    Кеширует GET-ответы view до сброса их тегов.
+
+    Ответ хранится отдельно для каждого пользователя, а без per_user — один
+    на всех, для страниц, не зависящих от зрителя.
+
+    get_tags(request, **kwargs) возвращает теги страницы, первый из них
+    основной и попадает в статистику. Вместе с ответом хранятся поколения
+    тегов и срок свежести (PAGE_CACHE_TTL с разбросом). Устаревшую запись
+    пересчитывает один запрос, получивший аренду, а остальные в пределах
+    PAGE_CACHE_GRACE секунд получают старую копию.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            tags = get_tags(request, *args, **kwargs)
+            versions = tag_versions(tags)
+            key = page_key(request, per_user)
+            entry = cache.get(key)
+            now = time.time()
+
+            if entry is not None and len(entry['versions']) == len(tags):
+                since = stale_since(entry, versions, now)
+                if since is None:
+                    record(tags[0], 'hit')
+                    return entry['response']
+                locked = acquire(key)
+                if not locked and now - since <= grace():
+                    record(tags[0], 'stale')
+                    request.page_cache_stale = True
+                    return entry['response']
+            else:
+                locked = acquire(key)
+
+            record(tags[0], 'miss')
+            try:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    fresh_for = ttl()
+                    cache.set(key, {
+                        'versions': versions,
+                        'expires': now + fresh_for,
+                        'response': response,
+                    }, fresh_for + grace())
+            finally:
+                if locked:
+                    release(key)
+            return response
+        return wrapper
+    return decorator
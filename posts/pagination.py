@@ -0,0 +1,106 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+POSTS_PER_PAGE = getattr(settings, 'POSTS_PER_PAGE', 10)
+
+
+def encode_cursor(post):
+    """Пакует позицию поста в ленте (pub_date, id) в непрозрачный токен."""
+    raw = f'{post.pub_date.isoformat()}|{post.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, id) из токена или None, если токен битый."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        pub_date, pk = raw.rsplit('|', 1)
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+def get_cursors(request):
+    """Курсоры ?after= и ?before= из запроса; задан может быть только один."""
+    after = decode_cursor(request.GET.get('after'))
+    before = None if after else decode_cursor(request.GET.get('before'))
+    return after, before
+
+
+def keyset_queryset(queryset, after=None, before=None,
+                    limit=POSTS_PER_PAGE, key=('pub_date', 'pk')):
+    """
+    Запрос limit + 1 строк по ключу (pub_date, id) от курсора.
+
+    Лишняя строка нужна только чтобы узнать, есть ли страница дальше, —
+    COUNT(*) и OFFSET не выполняются. key задаёт поля ключа, если
+    выбираются не сами посты. При before строки идут от старых к новым.
+    """
+    date_field, pk_field = key
+    if before is not None:
+        pub_date, pk = before
+        return queryset.filter(
+            Q(**{f'{date_field}__gt': pub_date})
+            | Q(**{date_field: pub_date, f'{pk_field}__gt': pk})
+        ).order_by(date_field, pk_field)[:limit + 1]
+    if after is not None:
+        pub_date, pk = after
+        queryset = queryset.filter(
+            Q(**{f'{date_field}__lt': pub_date})
+            | Q(**{date_field: pub_date, f'{pk_field}__lt': pk})
+        )
+    return queryset.order_by(f'-{date_field}', f'-{pk_field}')[:limit + 1]
+
+
+def keyset_window(queryset, after=None, before=None, limit=POSTS_PER_PAGE,
+                  key=('pub_date', 'pk')):
+    """Окно keyset_queryset, всегда отсортированное от новых к старым."""
+    rows = list(keyset_queryset(queryset, after, before, limit, key))
+    return rows[::-1] if before is not None else rows
+
+
+def paginate(request, queryset, per_page=POSTS_PER_PAGE):
+    """
+    Курсорная пагинация ленты по параметрам ?after= и ?before=.
+
+    Возвращает (paginator, page) как и раньше, но страница собирается из
+    одного запроса с LIMIT: page.next_cursor и page.previous_cursor
+    содержат токены для соседних страниц либо None.
+    """
+    after, before = get_cursors(request)
+    rows = keyset_window(queryset, after, before, per_page)
+    return paginate_rows(rows, after, before, per_page)
+
+
+def paginate_rows(rows, after=None, before=None, per_page=POSTS_PER_PAGE,
+                  encode=encode_cursor):
+    """Оформляет уже выбранное окно keyset_window в страницу."""
+    has_more = len(rows) > per_page
+    if before is not None:
+        posts = rows[-per_page:] if has_more else rows
+        has_next, has_previous = True, has_more
+    else:
+        posts = rows[:per_page]
+        has_next, has_previous = has_more, after is not None
+
+    paginator = Paginator(posts, per_page)
+    page = paginator.page(1)
+    page.next_cursor = (
+        encode(posts[-1]) if has_next and posts else None
+    )
+    page.previous_cursor = (
+        encode(posts[0]) if has_previous and posts else None
+    )
+    return paginator, page
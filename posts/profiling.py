@@ -0,0 +1,223 @@
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.backends import django as django_backend
+
+SECTIONS = ('sql', 'templates', 'thumbnails', 'python')
+NAME_CHARS = set('0123456789abcdef-')
+
+_local = threading.local()
+_installed = False
+
+
+def enabled():
+    return getattr(settings, 'PROFILER_ENABLED', False)
+
+
+def sample_rate():
+    return getattr(settings, 'PROFILER_SAMPLE_RATE', 0.01)
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILER_DIR',
+                   os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def keep():
+    return getattr(settings, 'PROFILER_KEEP', 200)
+
+
+class Breakdown:
+    """
+    Время запроса по разделам без двойного счёта.
+
+    Разделы вкладываются (SQL внутри шаблона, миниатюра внутри тега), и
+    время идёт только верхнему из открытых; всё вне разделов — python.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(SECTIONS, 0)
+        self.stack = ['python']
+        self.mark = time.perf_counter()
+
+    def switch(self):
+        now = time.perf_counter()
+        self.seconds[self.stack[-1]] += now - self.mark
+        self.mark = now
+
+    def enter(self, name):
+        self.switch()
+        self.stack.append(name)
+
+    def exit(self):
+        self.switch()
+        self.stack.pop()
+
+    def milliseconds(self):
+        self.switch()
+        return {name: round(value * 1000, 1)
+                for name, value in self.seconds.items()}
+
+
+@contextmanager
+def section(name):
+    breakdown = getattr(_local, 'breakdown', None)
+    if breakdown is None:
+        yield
+        return
+    breakdown.enter(name)
+    try:
+        yield
+    finally:
+        breakdown.exit()
+
+
+def timed(name):
+    """Относит время функции к разделу, если запрос сейчас профилируется."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'breakdown', None) is None:
+                return func(*args, **kwargs)
+            with section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def sql_section(execute, sql, params, many, context):
+    with section('sql'):
+        return execute(sql, params, many, context)
+
+
+def install():
+    """Подключает замер рендеринга шаблонов Django; вызывается один раз."""
+    global _installed
+    if _installed:
+        return
+    template_class = django_backend.Template
+    template_class.render = timed('templates')(template_class.render)
+    _installed = True
+
+
+def should_profile(request):
+    if request.META.get('HTTP_X_PROFILE') and request.user.is_staff:
+        return True
+    return random.random() < sample_rate()
+
+
+def rotate(directory):
+    """Оставляет keep() последних профилей."""
+    names = sorted(
+        name[:-len('.json')] for name in os.listdir(directory)
+        if name.endswith('.json')
+    )
+    for name in names[:max(len(names) - keep(), 0)]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def dump(profiler, meta):
+    """Пишет профиль cProfile и его описание; возвращает имя."""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    # Имена сортируются по времени: по ним работает ротация.
+    stamp = f'{time.time():.6f}'.replace('.', '-')
+    name = f'{stamp}-{uuid.uuid4().hex[:8]}'
+    profiler.dump_stats(os.path.join(directory, f'{name}.prof'))
+    with open(os.path.join(directory, f'{name}.json'), 'w',
+              encoding='utf-8') as output:
+        json.dump(dict(meta, name=name), output, ensure_ascii=False)
+    rotate(directory)
+    return name
+
+
+def recent(limit=50):
+    """Описания сохранённых профилей, самые медленные первыми."""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    entries = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename),
+                      encoding='utf-8') as source:
+                entries.append(json.load(source))
+        except (OSError, ValueError):
+            # Файл могла удалить ротация соседнего процесса.
+            continue
+    entries.sort(key=lambda entry: entry['total_ms'], reverse=True)
+    return entries[:limit]
+
+
+def profile_path(name):
+    """Путь к дампу по имени из recent() или None для чужих имён."""
+    if not name or not set(name) <= NAME_CHARS:
+        return None
+    path = os.path.join(profile_dir(), f'{name}.prof')
+    return path if os.path.exists(path) else None
+
+
+class ProfilerMiddleware:
+    """
+    Профилирует долю запросов (PROFILER_SAMPLE_RATE) и запросы сотрудников
+    с заголовком X-Profile: cProfile плюс разбивка времени на SQL, шаблоны,
+    миниатюры и Python. Включается PROFILER_ENABLED; стоит после
+    AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Уже работает другой профилировщик (в Python 3.12+ он один на
+            # процесс): запрос обслуживается без профиля.
+            return self.get_response(request)
+        _local.breakdown = breakdown = Breakdown()
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(sql_section):
+                response = self.get_response(request)
+        finally:
+            profiler.disable()
+            _local.breakdown = None
+        total_ms = (time.perf_counter() - started) * 1000
+        match = getattr(request, 'resolver_match', None)
+        name = dump(profiler, {
+            'path': request.get_full_path(),
+            'method': request.method,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'user': request.user.get_username(),
+            'started': started_at,
+            'total_ms': round(total_ms, 1),
+            'sections': breakdown.milliseconds(),
+        })
+        if request.META.get('HTTP_X_PROFILE') and request.user.is_staff:
+            response['X-Profile'] = name
+        return response
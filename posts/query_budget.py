@@ -0,0 +1,106 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(queries, sql_ms=None):
+    """
+    Объявляет бюджет view: сколько запросов к базе и миллисекунд SQL ей
+    можно потратить на один запрос. Подходит и для функций, и для
+    классов-представлений. Значения из QUERY_BUDGETS важнее.
+    """
+    def decorator(view):
+        view.query_budget = (queries, sql_ms)
+        return view
+    return decorator
+
+
+def view_name(view):
+    return f'{view.__module__}.{view.__qualname__}'
+
+
+def budget_for(view):
+    """(запросов, мс SQL) для view или None, если бюджета нет."""
+    overrides = getattr(settings, 'QUERY_BUDGETS', {})
+    name = view_name(view)
+    if name in overrides:
+        budget = overrides[name]
+        return budget if isinstance(budget, tuple) else (budget, None)
+    view_class = getattr(view, 'view_class', None)
+    return getattr(
+        view, 'query_budget', getattr(view_class, 'query_budget', None)
+    )
+
+
+def strict():
+    return getattr(settings, 'QUERY_BUDGET_STRICT', False)
+
+
+class QueryCounter:
+    """Считает запросы и время SQL через connection.execute_wrapper."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - started
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает запросы к базе и время SQL за весь запрос, включая остальные
+    middleware, и сверяет их с бюджетом view.
+
+    Превышение пишется в лог, а с QUERY_BUDGET_STRICT (тесты, CI) лишние
+    запросы выбрасывают QueryBudgetExceeded. Потоковые ответы не
+    проверяются: их запросы выполняются уже после middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        budget = getattr(request, 'query_budget', None)
+        if budget is None or response.streaming:
+            return response
+        queries, sql_ms = budget
+        spent_ms = counter.seconds * 1000
+        over_queries = counter.queries > queries
+        if not over_queries and (sql_ms is None or spent_ms <= sql_ms):
+            return response
+        message = (
+            f'{request.query_budget_view}: {counter.queries} запросов '
+            f'({spent_ms:.1f} мс SQL) при бюджете {queries}'
+            + (f' ({sql_ms} мс)' if sql_ms is not None else '')
+            + f', {request.method} {request.get_full_path()}'
+        )
+        # Время SQL зависит от машины, поэтому в строгом режиме падает
+        # только превышение числа запросов.
+        if over_queries and strict():
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = budget_for(view_func)
+        request.query_budget_view = view_name(view_func)
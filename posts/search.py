@@ -0,0 +1,177 @@
+import base64
+import binascii
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .pagination import POSTS_PER_PAGE, paginate_rows
+
+FTS_TABLE = 'posts_post_fts'
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+
+TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert "
+    f"AFTER INSERT ON posts_post BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete "
+    f"AFTER DELETE ON posts_post BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+    f"VALUES ('delete', old.id, old.text); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update "
+    f"AFTER UPDATE OF text ON posts_post BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+    f"VALUES ('delete', old.id, old.text); "
+    f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); "
+    f"END",
+]
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def ensure_triggers(using='default', **kwargs):
+    """
+    Восстанавливает триггеры синхронизации индекса после миграций.
+
+    SQLite пересоздаёт таблицу posts_post при изменении её схемы, и
+    триггеры, созданные миграцией 0015, при этом пропадают.
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+    if FTS_TABLE not in db.introspection.table_names():
+        return
+    with db.cursor() as cursor:
+        for statement in TRIGGERS:
+            cursor.execute(statement)
+
+
+def match_expression(query):
+    """
+    Превращает ввод пользователя в безопасный запрос FTS5.
+
+    Каждое слово берётся в кавычки, чтобы операторы FTS5 из ввода не
+    разбирались, последнее слово ищется по префиксу.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def encode_cursor(score, pk):
+    raw = f'{score!r}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        score, pk = base64.urlsafe_b64decode(
+            padded.encode()).decode().rsplit('|', 1)
+        return float(score), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def highlight(snippet):
+    return mark_safe(
+        escape(snippet)
+        .replace(SNIPPET_START, '<mark>')
+        .replace(SNIPPET_END, '</mark>')
+    )
+
+
+def ranked_matches(expression, after=None, before=None,
+                   limit=POSTS_PER_PAGE):
+    """
+    (score, id, snippet) найденных постов, лучшие первыми.
+
+    Страницы листаются по ключу (bm25, rowid) так же, как ленты по
+    (pub_date, id): без OFFSET и подсчёта результатов.
+    """
+    score = f'bm25({FTS_TABLE})'
+    where, params = [f'{FTS_TABLE} MATCH %s'], [expression]
+    order = 'ASC'
+    if after is not None:
+        where.append(f'({score} > %s OR ({score} = %s AND rowid > %s))')
+        params += [after[0], after[0], after[1]]
+    elif before is not None:
+        where.append(f'({score} < %s OR ({score} = %s AND rowid < %s))')
+        params += [before[0], before[0], before[1]]
+        order = 'DESC'
+    sql = (
+        f"SELECT {score}, rowid, snippet({FTS_TABLE}, 0, %s, %s, '…', 16) "
+        f"FROM {FTS_TABLE} WHERE {' AND '.join(where)} "
+        f"ORDER BY {score} {order}, rowid {order} LIMIT %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql, [SNIPPET_START, SNIPPET_END] + params + [limit + 1]
+        )
+        rows = cursor.fetchall()
+    return rows[::-1] if before is not None else rows
+
+
+def search_posts(request, per_page=POSTS_PER_PAGE):
+    """
+    Страница найденных по ?q= постов с подсвеченным фрагментом.
+
+    Возвращает (paginator, page), как и paginate(); у каждого поста есть
+    snippet, а курсоры страниц содержат ранг bm25 вместо даты.
+    """
+    query = request.GET.get('q', '').strip()
+    after = decode_cursor(request.GET.get('after'))
+    before = None if after else decode_cursor(request.GET.get('before'))
+    expression = match_expression(query)
+    if expression is None:
+        rows = []
+    elif not fts_available():
+        rows, after, before = fallback_search(query, per_page), None, None
+    else:
+        rows = ranked_matches(expression, after, before, per_page)
+        posts = Post.objects.for_feed().in_bulk([pk for _, pk, _ in rows])
+        for score, pk, snippet in rows:
+            if pk in posts:
+                posts[pk].search_score = score
+                posts[pk].snippet = highlight(snippet)
+        rows = [posts[pk] for _, pk, _ in rows if pk in posts]
+    return paginate_rows(
+        rows, after, before, per_page,
+        encode=lambda post: encode_cursor(post.search_score, post.pk)
+    )
+
+
+def fallback_search(query, per_page):
+    """Поиск подстрокой для баз без FTS5: только первая страница."""
+    condition = Q()
+    for word in re.findall(r'\w+', query):
+        condition &= Q(text__icontains=word)
+    posts = list(Post.objects.for_feed().filter(condition)[:per_page])
+    for post in posts:
+        post.snippet = post.text
+    return posts
+
+
+def matching_ids(query):
+    """Подзапрос id постов, подходящих под запрос, для фильтров ORM."""
+    expression = match_expression(query)
+    if expression is None:
+        return None
+    return RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        [expression]
+    )
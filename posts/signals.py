@@ -0,0 +1,111 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import follow_feed, page_cache, thumbnails
+from .models import Comment, Follow, Group, Post, User, UserCounter
+
+
+def bump_post_pages(post, old_group_slug=None):
+    UserCounter.touch(post.author_id)
+    group_slug = post.group.slug if post.group_id else None
+    page_cache.bump(
+        *page_cache.post_tags(post, {group_slug, old_group_slug})
+    )
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    # У нового пользователя все счётчики нулевые: строка создаётся сразу,
+    # а не пересчётом при первом показе профиля или первой подписке.
+    if created and not raw:
+        UserCounter.objects.create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_state(sender, instance, **kwargs):
+    old_group_slug, old_image = None, ''
+    if instance.pk:
+        old_group_slug, old_image = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group__slug', 'image').first() or (None, '')
+    instance._old_group_slug = old_group_slug
+    instance._image_changed = (instance.image.name or '') != (old_image or '')
+    if instance._image_changed:
+        instance.thumbnails_ready = False
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        UserCounter.bump(instance.author_id, 'posts_count', 1)
+        if follow_feed.inbox_enabled():
+            follow_feed.push(instance)
+    if instance.image and getattr(instance, '_image_changed', False):
+        thumbnails.schedule(instance)
+    bump_post_pages(instance, getattr(instance, '_old_group_slug', None))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    UserCounter.bump(instance.author_id, 'posts_count', -1)
+    bump_post_pages(instance)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1
+        )
+    bump_comment_pages(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1
+    )
+    bump_comment_pages(instance)
+
+
+def bump_comment_pages(comment):
+    post = Post.objects.select_related('author', 'group').filter(
+        pk=comment.post_id
+    ).first()
+    if post is not None:
+        bump_post_pages(post)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        UserCounter.bump(instance.author_id, 'followers_count', 1)
+        UserCounter.bump(instance.user_id, 'following_count', 1)
+        follow_feed.mark_pulled(instance.author_id)
+        if follow_feed.inbox_enabled():
+            follow_feed.backfill(instance.user_id, instance.author_id)
+    bump_follow_pages(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    UserCounter.bump(instance.author_id, 'followers_count', -1)
+    UserCounter.bump(instance.user_id, 'following_count', -1)
+    if follow_feed.inbox_enabled():
+        follow_feed.prune(instance.user_id, instance.author_id)
+    bump_follow_pages(instance)
+
+
+def bump_follow_pages(follow):
+    page_cache.bump(
+        f'profile:{follow.author.username}',
+        f'profile:{follow.user.username}',
+        f'feed:{follow.user_id}',
+    )
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    page_cache.bump('groups', f'group:{instance.slug}')
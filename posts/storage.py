@@ -0,0 +1,77 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранит файлы под именем sha256 их содержимого.
+
+    Одинаковые загрузки получают одно имя, поэтому делят и файл, и его
+    миниатюры sorl. Файл сначала пишется во временный рядом с целевым и
+    подменяется через os.replace, так что наполовину записанный файл под
+    настоящим именем не виден никогда. Неиспользуемые файлы удаляет
+    команда collect_media_garbage.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], f'{digest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Свежее время изменения защищает файл от collect_media_garbage,
+            # пока новый пост со ссылкой на него не сохранён.
+            os.utime(self.path(name))
+            return name.replace('\\', '/')
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+                output.flush()
+                os.fsync(output.fileno())
+            # mkstemp создаёт файл с правами 0600, а отдаёт загрузки
+            # веб-сервер под другим пользователем.
+            os.chmod(temporary, self.file_permissions_mode or 0o644)
+            os.replace(temporary, full_path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name.replace('\\', '/')
+
+    def walk(self, directory):
+        """Имена всех файлов в каталоге и подкаталогах, без временных."""
+        directories, files = self.listdir(directory)
+        for name in files:
+            if not name.startswith('.upload-'):
+                yield f'{directory.rstrip("/")}/{name}'
+        for subdirectory in directories:
+            yield from self.walk(f'{directory.rstrip("/")}/{subdirectory}')
+
+
+post_images = ContentAddressedStorage()
@@ -0,0 +1,104 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts import thumbnail_cache, thumbnails
+from posts.models import Post
+
+register = template.Library()
+
+CARD_KEY = 'post_card:{}:{}'
+CARD_TEMPLATE = 'posts/includes/post_item.html'
+EDIT_LINK_TEMPLATE = 'posts/includes/post_edit_link.html'
+EDIT_LINK_MARKER = '<!-- post-edit-link -->'
+
+
+def card_version(post):
+    """Меняется вместе со всем, что видно в карточке."""
+    group = post.group if post.group_id else None
+    parts = [
+        post.text, post.image.name or '', post.thumbnails_ready,
+        post.thumbnails_version,
+        post.pub_date.isoformat(),
+        post.comment_count, post.author.username,
+        group.slug if group else '', group.title if group else '',
+        thumbnails.presets_version(),
+    ]
+    raw = '\x00'.join(str(part) for part in parts)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def card_key(post):
+    return CARD_KEY.format(post.pk, card_version(post))
+
+
+def card_ttl():
+    return getattr(settings, 'POST_CARD_CACHE_TTL', 3600)
+
+
+def render_cards(posts):
+    """HTML карточек без частей, зависящих от зрителя; один get_many."""
+    keys = [card_key(post) for post in posts]
+    cached = cache.get_many(keys)
+    stale = [
+        (post, key) for post, key in zip(posts, keys) if key not in cached
+    ]
+    thumbnails.prefetch([post for post, _ in stale])
+    # Миниатюры могли вытеснить из каталога: построим их заново.
+    thumbnails.ensure_jobs([post for post, _ in stale])
+    missing = {
+        key: render_to_string(CARD_TEMPLATE, {'post': post})
+        for post, key in stale
+    }
+    if missing:
+        # Ключ меняется вместе с карточкой, а старые версии никто не
+        # удаляет: их убирает только срок жизни.
+        cache.set_many(missing, card_ttl())
+        cached.update(missing)
+    return [cached[key] for key in keys]
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    if isinstance(posts, Post):
+        posts = [posts]
+    posts = list(posts)
+    thumbnail_cache.touch(posts)
+    user = context.get('user')
+    html = []
+    for post, card in zip(posts, render_cards(posts)):
+        edit_link = ''
+        if user is not None and user.pk == post.author_id:
+            edit_link = render_to_string(EDIT_LINK_TEMPLATE, {'post': post})
+        html.append(card.replace(EDIT_LINK_MARKER, edit_link))
+    return mark_safe(''.join(html))
+
+
+@register.simple_tag
+def post_picture(post, family):
+    """
+    Данные для <picture>: источники WebP, запасной JPEG со srcset и sizes.
+
+    None, пока варианты не построены.
+    """
+    if not post.image or not post.thumbnails_ready:
+        return None
+    sources = thumbnails.responsive(post.image, family)
+    if sources is None:
+        return None
+    *alternatives, (_, srcset, largest) = sources
+    return {
+        'sources': [
+            {'type': mime, 'srcset': variants}
+            for mime, variants, _ in alternatives
+        ],
+        'srcset': srcset,
+        'src': largest['url'],
+        'width': largest['width'],
+        'height': largest['height'],
+        'sizes': getattr(settings, 'THUMBNAIL_CARD_SIZES', '100vw'),
+    }
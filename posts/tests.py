@@ -1,13 +1,62 @@
-from django.test import TestCase, Client
-from django.urls import reverse
-from django.core.files.uploadedfile import SimpleUploadedFile
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image, ImageFile
+from sorl.thumbnail import default
+
+from django.test import TestCase, Client, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import (SimpleUploadedFile,
+                                            TemporaryUploadedFile)
 from django.core.cache import cache
-from .models import Post, User, Group, Follow, Comment
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from . import (follow_feed, page_cache, profiling, thumbnail_cache,
+               thumbnails)
+from .forms import PostForm
+from .pagination import keyset_queryset
+from .query_budget import QueryBudgetExceeded
+from .storage import post_images
+from .templatetags import post_cards
+from .models import (Comment, FeedEntry, Follow, Group, Post,
+                     ThumbnailJob, User, UserCounter)
+
+
+# Загрузки и миниатюры тестов не должны попадать в настоящий MEDIA_ROOT.
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+
+def use_temporary_media(test):
+    """
+    Пустой MEDIA_ROOT внутри TEMP_MEDIA_ROOT на время теста: тесты считают
+    файлы на диске, и загрузки соседних тестов им мешали бы.
+    """
+    media_root = test.settings(
+        MEDIA_ROOT=tempfile.mkdtemp(dir=TEMP_MEDIA_ROOT)
+    )
+    media_root.enable()
+    test.addCleanup(media_root.disable)
 
 
 class PostTests(TestCase):
     def setUp(self):
+        use_temporary_media(self)
         cache.clear()
+        default.kvstore.lru_clear()
         self.client = Client()
         self.user = User.objects.create_user(username='testuser')
         self.client.force_login(self.user)
@@ -153,11 +202,37 @@ class PostTests(TestCase):
     def test_cache(self):
         self.client.get(reverse('index'))
         Post.objects.create(text='check text', author=self.user)
-        response1 = self.client.get(reverse('index'))
-        self.assertNotContains(response1, 'check text')
-        cache.clear()
-        response2 = self.client.get(reverse('index'))
-        self.assertContains(response2, 'check text')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'check text')
+
+        Post.objects.update(text='changed without signals')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'check text')
+
+        self.group.title = 'renamed group'
+        self.group.save()
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'changed without signals')
+
+    def test_cache_invalidated_by_related_changes(self):
+        author = User.objects.create_user(username='cached_author')
+        post = Post.objects.create(
+            text='text', author=author, group=self.group
+        )
+        Follow.objects.create(user=self.user, author=author)
+        urls = [
+            reverse('group', kwargs={'slug': self.group.slug}),
+            reverse('profile', kwargs={'username': author.username}),
+            reverse('follow_index'),
+        ]
+        for url in urls:
+            self.client.get(url)
+        Comment.objects.create(post=post, author=self.user, text='comment')
+        for url in urls:
+            self.assertContains(self.client.get(url), '1 комментариев')
+        self.assertEqual(page_cache.stats()[('group', 'hit')], 0)
+        self.client.get(urls[0])
+        self.assertEqual(page_cache.stats()[('group', 'hit')], 1)
 
     def test_follow(self):
         author = User.objects.create_user(username='foll_author')
@@ -258,3 +333,1149 @@ class PostTests(TestCase):
         self.client_anon.post(url_comment, {'text': text_comm}, follow=True)
         comment_count = Comment.objects.all().count()
         self.assertEqual(comment_count, 0)
+
+    def test_cursor_pagination(self):
+        for i in range(15):
+            Post.objects.create(text=f'post {i}', author=self.user)
+        url = reverse('profile', kwargs={'username': self.user.username})
+        response = self.client.get(url)
+        first_page = response.context['page']
+        self.assertEqual(len(first_page), 10)
+        self.assertEqual(first_page[0].text, 'post 14')
+        self.assertIsNone(first_page.previous_cursor)
+        self.assertIsNotNone(first_page.next_cursor)
+
+        response = self.client.get(url, {'after': first_page.next_cursor})
+        second_page = response.context['page']
+        self.assertEqual(
+            [post.text for post in second_page],
+            [f'post {i}' for i in range(4, -1, -1)]
+        )
+        self.assertIsNone(second_page.next_cursor)
+
+        response = self.client.get(
+            url, {'before': second_page.previous_cursor}
+        )
+        self.assertEqual(
+            list(response.context['page']), list(first_page.object_list)
+        )
+        self.assertIsNone(response.context['page'].previous_cursor)
+
+    def test_cursor_pagination_no_offset(self):
+        for i in range(12):
+            Post.objects.create(text=f'post {i}', author=self.user)
+        response = self.client.get(reverse('index'))
+        token = response.context['page'].next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'), {'after': token})
+        sql = ' '.join(q['sql'] for q in queries.captured_queries)
+        self.assertNotIn('OFFSET', sql)
+        self.assertNotIn('COUNT(*)', sql)
+
+    def test_feed_queries_do_not_depend_on_page_size(self):
+        def count_queries(url):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            return len(queries)
+
+        author = User.objects.create_user(username='feed_author')
+        Follow.objects.create(user=self.user, author=author)
+        urls = [
+            reverse('index'),
+            reverse('group', kwargs={'slug': self.group.slug}),
+            reverse('profile', kwargs={'username': author.username}),
+            reverse('follow_index'),
+        ]
+        post = Post.objects.create(
+            text='text', author=author, group=self.group
+        )
+        Comment.objects.create(post=post, author=self.user, text='comment')
+        cache.clear()
+        single = [count_queries(url) for url in urls]
+
+        for i in range(9):
+            post = Post.objects.create(
+                text=f'text {i}', author=author, group=self.group
+            )
+            Comment.objects.create(post=post, author=self.user, text='c')
+        cache.clear()
+        self.assertEqual([count_queries(url) for url in urls], single)
+
+    def test_counters(self):
+        author = User.objects.create_user(username='count_author')
+        post = Post.objects.create(text='text', author=author)
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='comment'
+        )
+        Follow.objects.create(user=self.user, author=author)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        counters = UserCounter.objects.get(user=author)
+        self.assertEqual(counters.posts_count, 1)
+        self.assertEqual(counters.followers_count, 1)
+        self.assertEqual(UserCounter.objects.get(
+            user=self.user).following_count, 1)
+
+        response = self.client.get(
+            reverse('profile', kwargs={'username': author.username})
+        )
+        self.assertEqual(response.context['posts_count'], 1)
+        self.assertEqual(response.context['count_followers'], 1)
+
+        comment.delete()
+        Follow.objects.filter(user=self.user, author=author).delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+        counters.refresh_from_db()
+        self.assertEqual(counters.followers_count, 0)
+        post.delete()
+        counters.refresh_from_db()
+        self.assertEqual(counters.posts_count, 0)
+
+    def test_delete_user_with_counters(self):
+        author = User.objects.create_user(username='count_author')
+        post = Post.objects.create(text='text', author=author)
+        Comment.objects.create(post=post, author=author, text='comment')
+        Follow.objects.create(user=self.user, author=author)
+        Follow.objects.create(user=author, author=self.user)
+        author.delete()
+        counters = UserCounter.objects.get(user=self.user)
+        self.assertEqual(counters.followers_count, 0)
+        self.assertEqual(counters.following_count, 0)
+
+    def test_reconcile_counters(self):
+        post = Post.objects.create(text='text', author=self.user)
+        Comment.objects.create(post=post, author=self.user, text='comment')
+        Post.objects.update(comment_count=5)
+        UserCounter.objects.filter(user=self.user).update(posts_count=7)
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(
+            UserCounter.objects.get(user=self.user).posts_count, 1
+        )
+
+    @override_settings(FOLLOW_FEED_INBOX=True, FOLLOW_FEED_INBOX_SIZE=3)
+    def test_follow_inbox(self):
+        author = User.objects.create_user(username='inbox_author')
+        old_post = Post.objects.create(text='old', author=author)
+        self.client.get(
+            reverse('profile_follow', kwargs={'username': author.username})
+        )
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.user, post=old_post).exists()
+        )
+        for i in range(4):
+            Post.objects.create(text=f'new {i}', author=author)
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(), 3)
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(
+            [post.text for post in response.context['page']],
+            ['new 3', 'new 2', 'new 1']
+        )
+        self.client.get(
+            reverse('profile_unfollow', kwargs={'username': author.username})
+        )
+        self.assertFalse(FeedEntry.objects.filter(user=self.user).exists())
+
+    @override_settings(FOLLOW_FEED_INBOX=True, FOLLOW_FEED_PULL_THRESHOLD=1)
+    def test_follow_feed_pulls_popular_authors(self):
+        star = User.objects.create_user(username='star')
+        regular = User.objects.create_user(username='regular')
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=fan, author=star)
+        Follow.objects.create(user=self.user, author=star)
+        Follow.objects.create(user=self.user, author=regular)
+        texts = []
+        for i in range(6):
+            author = star if i % 2 else regular
+            Post.objects.create(text=f'post {i}', author=author)
+            texts.append(f'post {i}')
+        self.assertFalse(FeedEntry.objects.filter(post__author=star).exists())
+
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(
+            [post.text for post in response.context['page']], texts[::-1]
+        )
+        out = StringIO()
+        call_command('follow_feed_report', stdout=out)
+        self.assertIn('pull read: 3', out.getvalue())
+
+    @override_settings(FOLLOW_FEED_INBOX=True, FOLLOW_FEED_PULL_THRESHOLD=1)
+    def test_follow_feed_keeps_posts_when_author_drops_below_threshold(self):
+        star = User.objects.create_user(username='star')
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=fan, author=star)
+        Follow.objects.create(user=self.user, author=star)
+        Post.objects.create(text='пока звезда', author=star)
+        self.assertFalse(FeedEntry.objects.filter(post__author=star).exists())
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, 'пока звезда')
+
+        # Подписчиков снова не больше порога: отписки и повторные подписки
+        # ничего не раскладывают, пост читается при показе.
+        fan_client = Client()
+        fan_client.force_login(fan)
+        for view in ('profile_unfollow', 'profile_follow', 'profile_unfollow'):
+            fan_client.get(reverse(view, kwargs={'username': 'star'}))
+        self.assertFalse(FeedEntry.objects.filter(post__author=star).exists())
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, 'пока звезда')
+
+        out = StringIO()
+        call_command('unpull_follow_feeds', stdout=out)
+        self.assertIn('разложено по ящикам: 1', out.getvalue())
+        self.assertFalse(follow_feed.is_pulled(star.pk))
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.user, post__author=star
+        ).exists())
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, 'пока звезда')
+
+    def test_stale_page_served_while_another_request_recomputes(self):
+        self.client.get(reverse('index'))
+        Post.objects.create(text='fresh text', author=self.user)
+        with mock.patch.object(page_cache, 'acquire', return_value=False):
+            response = self.client.get(reverse('index'))
+            self.assertNotContains(response, 'fresh text')
+            with override_settings(PAGE_CACHE_GRACE=0):
+                response = self.client.get(reverse('index'))
+                self.assertContains(response, 'fresh text')
+        self.assertEqual(page_cache.stats()[('index', 'stale')], 1)
+
+    @override_settings(PAGE_CACHE_TTL=600, PAGE_CACHE_LOCAL_TTL=20,
+                       PAGE_CACHE_JITTER=0)
+    def test_local_memory_cache_keeps_pages_briefly(self):
+        # Сбросы тегов из других процессов в память этого не попадают.
+        self.assertFalse(page_cache.shared_cache())
+        self.assertEqual(page_cache.ttl(), 20)
+        with mock.patch.object(page_cache, 'shared_cache', return_value=True):
+            self.assertEqual(page_cache.ttl(), 600)
+
+    def test_post_card_cache_shared_between_viewers(self):
+        other = User.objects.create_user(username='other')
+        post = Post.objects.create(text='card text', author=self.user)
+        edit_url = reverse(
+            'post_edit',
+            kwargs={'username': self.user.username, 'post_id': post.pk}
+        )
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, edit_url)
+
+        self.client.force_login(other)
+        with mock.patch.object(
+                post_cards, 'render_to_string',
+                wraps=post_cards.render_to_string) as render:
+            response = self.client.get(reverse('index'))
+        render.assert_not_called()
+        self.assertContains(response, 'card text')
+        self.assertNotContains(response, edit_url)
+
+        Comment.objects.create(post=post, author=other, text='comment')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '1 комментариев')
+
+    @override_settings(POST_CARD_CACHE_TTL=5)
+    def test_post_cards_expire(self):
+        post = Post.objects.create(text='card text', author=self.user)
+        with mock.patch.object(post_cards.cache, 'set_many') as set_many:
+            post_cards.render_cards([post])
+        set_many.assert_called_once_with(mock.ANY, 5)
+
+    def test_search(self):
+        post = Post.objects.create(
+            text='Дом на колёсах <b>едет</b>', author=self.user
+        )
+        Post.objects.create(text='совсем другое', author=self.user)
+        response = self.client.get(reverse('search'), {'q': 'колёсах'})
+        page = response.context['page']
+        self.assertEqual(list(page), [post])
+        self.assertContains(response, '<mark>колёсах</mark>')
+        self.assertContains(response, '&lt;b&gt;едет&lt;/b&gt;')
+
+        post.text = 'теперь про палатки'
+        post.save()
+        response = self.client.get(reverse('search'), {'q': 'палат'})
+        self.assertEqual(list(response.context['page']), [post])
+        response = self.client.get(reverse('search'), {'q': 'колёсах'})
+        self.assertEqual(len(response.context['page']), 0)
+
+    def test_search_pagination(self):
+        for i in range(15):
+            Post.objects.create(text=f'фургон {i}', author=self.user)
+        response = self.client.get(reverse('search'), {'q': 'фургон'})
+        first = response.context['page']
+        self.assertEqual(len(first), 10)
+        response = self.client.get(
+            reverse('search'), {'q': 'фургон', 'after': first.next_cursor}
+        )
+        second = response.context['page']
+        self.assertEqual(len(second), 5)
+        self.assertFalse(set(first.object_list) & set(second.object_list))
+        response = self.client.get(
+            reverse('search'),
+            {'q': 'фургон', 'before': second.previous_cursor}
+        )
+        self.assertEqual(
+            list(response.context['page']), list(first.object_list)
+        )
+
+    def test_admin_search(self):
+        from django.contrib.admin.sites import site
+        post = Post.objects.create(text='прицеп', author=self.user)
+        Post.objects.create(text='лодка', author=self.user)
+        queryset, use_distinct = site._registry[Post].get_search_results(
+            None, Post.objects.all(), 'прицеп'
+        )
+        self.assertEqual(list(queryset), [post])
+
+    def test_rebuild_search_index(self):
+        post = Post.objects.create(text='автодом', author=self.user)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO posts_post_fts(posts_post_fts) "
+                "VALUES ('delete-all')"
+            )
+        call_command('rebuild_search_index', chunk_size=1, stdout=StringIO())
+        response = self.client.get(reverse('search'), {'q': 'автодом'})
+        self.assertEqual(list(response.context['page']), [post])
+
+    def test_thumbnails_generated_by_job(self):
+        small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
+            b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
+            b'\x02\x4c\x01\x00\x3b'
+        )
+        img = SimpleUploadedFile(
+            name='job.gif', content=small_gif, content_type='image/gif'
+        )
+        self.client.post(
+            reverse('new_post'), {'text': 'with image', 'image': img}
+        )
+        post = Post.objects.get()
+        self.assertFalse(post.thumbnails_ready)
+        self.assertEqual(ThumbnailJob.objects.filter(post=post).count(), 1)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'placeholder.svg')
+
+        call_command('process_thumbnail_jobs', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        self.assertFalse(ThumbnailJob.objects.exists())
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'placeholder.svg')
+        self.assertContains(response, '/media/cache/')
+
+        # Новый пресет: готовые посты снова встают в очередь при показе.
+        presets = dict(thumbnails.presets(), card_480_jpeg=(
+            '480x170', {'crop': 'center', 'upscale': True}
+        ))
+        with self.settings(THUMBNAIL_PRESETS=presets):
+            cache.clear()
+            self.client.get(reverse('index'))
+            self.assertEqual(
+                ThumbnailJob.objects.filter(post=post).count(), 1
+            )
+            call_command('process_thumbnail_jobs', stdout=StringIO())
+            post.refresh_from_db()
+            self.assertEqual(
+                post.thumbnails_version, thumbnails.presets_version()
+            )
+            response = self.client.get(reverse('index'))
+            self.assertContains(response, '.jpg 480w')
+            self.assertFalse(ThumbnailJob.objects.exists())
+
+    def test_responsive_variants(self):
+        buffer = BytesIO()
+        Image.effect_noise((1200, 600), 64).convert('RGB').save(
+            buffer, 'JPEG', quality=95
+        )
+        img = SimpleUploadedFile(
+            name='wide.jpg', content=buffer.getvalue(),
+            content_type='image/jpeg'
+        )
+        self.client.post(
+            reverse('new_post'), {'text': 'wide', 'image': img}
+        )
+        call_command('process_thumbnail_jobs', stdout=StringIO())
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'type="image/webp"')
+        for width in (320, 640, 960):
+            self.assertContains(response, f'.webp {width}w')
+            self.assertContains(response, f'.jpg {width}w')
+
+        out = StringIO()
+        call_command('feed_image_bytes', width=320, dpr=1, stdout=out)
+        sizes = dict(
+            line.split(': ')[0:2] for line in out.getvalue().splitlines()[1:]
+        )
+        widest = int(sizes['без srcset'].split()[0])
+        self.assertLess(int(sizes['webp 320w'].split()[0]), widest)
+        self.assertLess(int(sizes['jpeg 320w'].split()[0]), widest)
+
+    def test_identical_images_share_one_file(self):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 20), (10, 200, 10)).save(buffer, 'PNG')
+        for name in ('meme.png', 'repost.png'):
+            img = SimpleUploadedFile(
+                name=name, content=buffer.getvalue(),
+                content_type='image/png'
+            )
+            self.client.post(
+                reverse('new_post'), {'text': name, 'image': img}
+            )
+        first, second = Post.objects.order_by('pk')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(
+            first.image.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.png$'
+        )
+
+        out = StringIO()
+        call_command('collect_media_garbage', min_age=0, stdout=out)
+        self.assertIn('Удалено файлов: 0', out.getvalue())
+        storage = first.image.storage
+        name = first.image.name
+        first.delete()
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        self.assertTrue(storage.exists(name))
+        second.delete()
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        self.assertFalse(storage.exists(name))
+
+    def test_reupload_of_orphan_survives_garbage_collection(self):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 20), (200, 10, 10)).save(buffer, 'PNG')
+        content = buffer.getvalue()
+        name = post_images.save('posts/old.png', ContentFile(content))
+        path = post_images.path(name)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+        old = time.time() - 7 * 24 * 3600
+        os.utime(path, (old, old))
+
+        # Повторная загрузка старой сироты: пост ещё не сохранён, но файл
+        # уже не старше --min-age.
+        again = post_images.save('posts/again.png', ContentFile(content))
+        self.assertEqual(again, name)
+        self.assertGreater(os.stat(path).st_mtime, old + 3600)
+        call_command('collect_media_garbage', stdout=StringIO())
+        self.assertTrue(post_images.exists(name))
+
+    def test_thumbnail_records_prefetched_per_page(self):
+        for color in ((255, 0, 0), (0, 0, 255)):
+            buffer = BytesIO()
+            Image.new('RGB', (40, 20), color).save(buffer, 'PNG')
+            img = SimpleUploadedFile(
+                name='color.png', content=buffer.getvalue(),
+                content_type='image/png'
+            )
+            self.client.post(
+                reverse('new_post'), {'text': 'color', 'image': img}
+            )
+        call_command('process_thumbnail_jobs', stdout=StringIO())
+        cache.clear()
+        default.kvstore.lru_clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'image/webp', count=2)
+        kvstore_queries = [
+            query for query in queries.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ])
+
+    def test_backfill_thumbnails_resumes_from_checkpoint(self):
+        posts = []
+        for color in ((255, 0, 0), (0, 0, 255)):
+            buffer = BytesIO()
+            Image.new('RGB', (40, 20), color).save(buffer, 'PNG')
+            posts.append(Post.objects.create(
+                text='color', author=self.user,
+                image=SimpleUploadedFile('color.png', buffer.getvalue()),
+            ))
+        ThumbnailJob.objects.all().delete()
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = f'{directory}/checkpoint'
+            with open(checkpoint, 'w') as file:
+                file.write(str(posts[0].pk))
+            out = StringIO()
+            call_command(
+                'backfill_thumbnails', workers=0, chunk_size=1,
+                checkpoint=checkpoint, stdout=out
+            )
+        self.assertIn('Обработано 1/1', out.getvalue())
+        ready = dict(Post.objects.values_list('pk', 'thumbnails_ready'))
+        self.assertEqual(ready, {posts[0].pk: False, posts[1].pk: True})
+
+    def test_evict_least_recently_shown_thumbnails(self):
+        old, recent = [], []
+        for posts, color in ((old, (255, 0, 0)), (recent, (0, 0, 255))):
+            buffer = BytesIO()
+            Image.new('RGB', (40, 20), color).save(buffer, 'PNG')
+            posts.append(Post.objects.create(
+                text='color', author=self.user,
+                image=SimpleUploadedFile('color.png', buffer.getvalue()),
+            ))
+        call_command('process_thumbnail_jobs', stdout=StringIO())
+        old, recent = Post.objects.filter(
+            pk__in=[old[0].pk, recent[0].pk]
+        ).order_by('pk')
+        default.storage.save('cache/ff/ff/orphan.jpg', ContentFile(b'x'))
+        day_ago = time.time() - 24 * 3600
+        os.utime(default.storage.path('cache/ff/ff/orphan.jpg'),
+                 (day_ago, day_ago))
+        # Только что записанная миниатюра, запись sorl о которой ещё не
+        # сохранена.
+        default.storage.save('cache/ff/ff/fresh.jpg', ContentFile(b'x'))
+        cache.set(thumbnail_cache.access_key(old.image.name), 1, None)
+        thumbnail_cache.touch([recent])
+
+        # Удаления сиротского байта не хватит, нужна ещё одна картинка.
+        total = sum(size for size, _ in thumbnail_cache.scan().values())
+        out = StringIO()
+        call_command('evict_thumbnails', budget=total - 2, stdout=out)
+        self.assertIn('ничьих файлов: 1, миниатюр картинок: 1',
+                      out.getvalue())
+        self.assertFalse(default.storage.exists('cache/ff/ff/orphan.jpg'))
+        self.assertTrue(default.storage.exists('cache/ff/ff/fresh.jpg'))
+        default.kvstore.lru_clear()
+        self.assertIsNone(thumbnails.lookup(old.image, 'card_320_webp'))
+        self.assertIsNotNone(
+            thumbnails.lookup(recent.image, 'card_320_webp')
+        )
+        old.refresh_from_db()
+        self.assertFalse(old.thumbnails_ready)
+
+        self.client.get(reverse('index'))
+        self.assertTrue(ThumbnailJob.objects.filter(post=old).exists())
+
+    def test_import_content(self):
+        reader = User.objects.create_user(username='reader')
+        rows = [
+            {'type': 'follow', 'user': 'reader', 'author': 'testuser'},
+            {'type': 'post', 'author': 'testuser', 'text': 'импорт один',
+             'group': 'gr_slug', 'pub_date': '2019-05-01T10:00:00',
+             'ref': 'a1'},
+            {'type': 'post', 'author': 'testuser', 'text': 'импорт два'},
+            {'type': 'comment', 'author': 'reader', 'text': 'ок',
+             'post_ref': 'a1'},
+            {'type': 'post', 'author': 'nobody', 'text': 'lost'},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as file:
+            file.write('\n'.join(json.dumps(row) for row in rows))
+            file.flush()
+            out, err = StringIO(), StringIO()
+            call_command(
+                'import_content', file.name, batch_size=1,
+                transaction_size=2, stdout=out, stderr=err
+            )
+        self.assertIn('post: 2, comment: 1, follow: 1; пропущено строк: 1',
+                      out.getvalue())
+        self.assertIn('строк/с', out.getvalue())
+        self.assertIn('nobody', err.getvalue())
+
+        first = Post.objects.get(text='импорт один')
+        self.assertEqual(first.pub_date.year, 2019)
+        self.assertEqual(first.group, self.group)
+        self.assertEqual(first.comment_count, 1)
+        counters = UserCounter.objects.get(user=self.user)
+        self.assertEqual(
+            (counters.posts_count, counters.followers_count), (2, 1)
+        )
+        self.assertEqual(
+            FeedEntry.objects.filter(user=reader).count(), 2
+        )
+        response = self.client.get(reverse('search'), {'q': 'импорт'})
+        self.assertEqual(len(response.context['page']), 2)
+
+    def test_export_round_trip(self):
+        author = User.objects.create_user(username='author')
+        post = Post.objects.create(
+            text='экспорт', author=author, group=self.group
+        )
+        Comment.objects.create(post=post, author=self.user, text='ок')
+        Follow.objects.create(user=self.user, author=author)
+        out = StringIO()
+        call_command('export_content', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            [row['type'] for row in rows],
+            ['group', 'post', 'comment', 'follow']
+        )
+        self.assertEqual(rows[2]['post_ref'], rows[1]['ref'])
+
+        Post.objects.all().delete()
+        Group.objects.all().delete()
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as file:
+            file.write(out.getvalue())
+            file.flush()
+            call_command('import_content', file.name, stdout=StringIO())
+        deleted_pk, post = post.pk, Post.objects.get()
+        # id удалённого поста не переиспользуется.
+        self.assertGreater(post.pk, deleted_pk)
+        self.assertEqual(post.group.slug, 'gr_slug')
+        self.assertEqual(post.comments.get().text, 'ок')
+
+    def test_export_endpoint_staff_only(self):
+        Post.objects.create(text='экспорт', author=self.user)
+        response = self.client.get(reverse('export'))
+        self.assertEqual(response.status_code, 302)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(
+            reverse('export'), {'format': 'csv', 'kinds': 'post'}
+        )
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('type,'))
+        self.assertEqual(len(lines), 2)
+        self.assertIn('экспорт', lines[1])
+        response = self.client.get(reverse('export'), {'kinds': 'secret'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_feed_pages_and_conditional_get(self):
+        for number in range(12):
+            Post.objects.create(
+                text=f'api {number}', author=self.user, group=self.group
+            )
+        response = self.client_anon.get(reverse('api_index'))
+        data = response.json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0]['text'], 'api 11')
+        self.assertEqual(data['results'][0]['group'], 'gr_slug')
+        self.assertIsNone(data['previous'])
+        response = self.client_anon.get(
+            reverse('api_index'), {'after': data['next']}
+        )
+        self.assertEqual(len(response.json()['results']), 2)
+
+        response = self.client_anon.get(reverse('api_index'))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client_anon.get(
+                reverse('api_index'), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        Post.objects.create(text='новый', author=self.user)
+        response = self.client_anon.get(
+            reverse('api_index'), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['text'], 'новый')
+
+    @override_settings(PAGE_CACHE_LOCAL_TTL=20)
+    def test_api_validators_expire_with_local_cache(self):
+        url = reverse('api_index')
+        response = self.client_anon.get(url)
+        etag, modified = response['ETag'], response['Last-Modified']
+        later = time.time() + 30
+        # Сброс в другом процессе сюда не дошёл, но через
+        # PAGE_CACHE_LOCAL_TTL поколения тегов, а с ними и валидаторы,
+        # устаревают сами.
+        with mock.patch('time.time', return_value=later):
+            response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            response = self.client_anon.get(
+                url, HTTP_IF_MODIFIED_SINCE=modified
+            )
+            self.assertEqual(response.status_code, 200)
+
+        cache.clear()
+        with mock.patch.object(page_cache, 'shared_cache', return_value=True):
+            etag = self.client_anon.get(url)['ETag']
+            with mock.patch('time.time', return_value=later):
+                response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_api_post_and_follow(self):
+        post = Post.objects.create(text='пост', author=self.user)
+        url = reverse('api_post', kwargs={'post_id': post.pk})
+        etag = self.client_anon.get(url)['ETag']
+        Comment.objects.create(post=post, author=self.user, text='коммент')
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['comments'], 1)
+        self.assertEqual(data['comment_list'][0]['text'], 'коммент')
+        self.assertEqual(
+            self.client_anon.post(url).status_code, 405
+        )
+        self.assertEqual(
+            self.client_anon.get(reverse('api_follow')).status_code, 401
+        )
+        response = self.client.get(reverse('api_follow'))
+        self.assertEqual(response.json()['results'], [])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_post_page_conditional_get(self):
+        post = Post.objects.create(text='пост', author=self.user)
+        url = reverse(
+            'post', kwargs={'username': 'testuser', 'post_id': post.pk}
+        )
+        response = self.client_anon.get(url)
+        etag = response['ETag']
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=60', response['Cache-Control'])
+        self.assertFalse(response.has_header('Last-Modified'))
+        with self.assertNumQueries(1):
+            response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('public', response['Cache-Control'])
+        # Без ETag 304 не бывает: время правки не видит комментариев.
+        response = self.client_anon.get(
+            url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        post.group = self.group
+        post.save()
+        etag = self.client_anon.get(url)['ETag']
+        self.group.title = 'новое название'
+        self.group.save()
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'новое название')
+
+        post.text = 'правка'
+        post.save()
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        Comment.objects.create(post=post, author=self.user, text='коммент')
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'коммент')
+
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_profile_conditional_get(self):
+        Post.objects.create(text='пост', author=self.user)
+        url = reverse('profile', kwargs={'username': 'testuser'})
+        etag = self.client_anon.get(url)['ETag']
+        # Версия профиля — одна строка счётчиков, без обхода постов.
+        with self.assertNumQueries(1):
+            response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.user)
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        post = Post.objects.create(text='второй', author=self.user)
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'второй')
+        etag = response['ETag']
+        Comment.objects.create(post=post, author=reader, text='коммент')
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        post.group = self.group
+        post.save()
+        etag = self.client_anon.get(url)['ETag']
+        self.group.title = 'новое название'
+        self.group.save()
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'новое название')
+        self.assertEqual(
+            self.client_anon.get(
+                reverse('profile', kwargs={'username': 'nobody'})
+            ).status_code, 404
+        )
+
+    def test_syndication_feeds(self):
+        Post.objects.create(
+            text='в группе', author=self.user, group=self.group
+        )
+        Post.objects.create(text='без группы', author=self.user)
+        response = self.client_anon.get(reverse('rss'))
+        self.assertEqual(response['Content-Type'][:19], 'application/rss+xml')
+        self.assertEqual(response.content.count(b'<item>'), 2)
+        response = self.client_anon.get(
+            reverse('group_atom', kwargs={'slug': 'gr_slug'})
+        )
+        self.assertEqual(response.content.count(b'<entry>'), 1)
+        self.assertContains(response, 'в группе')
+        response = self.client_anon.get(
+            reverse('author_rss', kwargs={'username': 'testuser'})
+        )
+        self.assertEqual(response.content.count(b'<item>'), 2)
+        self.assertEqual(self.client_anon.get(
+            reverse('group_rss', kwargs={'slug': 'nothing'})
+        ).status_code, 404)
+
+        url = reverse('group_rss', kwargs={'slug': 'gr_slug'})
+        response = self.client_anon.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client_anon.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+        Post.objects.create(
+            text='свежий', author=self.user, group=self.group
+        )
+        response = self.client_anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'свежий')
+
+        # Лента одна для всех зрителей: вошедший получает ту же копию.
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['ETag'], etag)
+        self.assertNotIn('private', response['Cache-Control'])
+
+        # Лента сайта не закрывает ленту пользователя с именем feed(s).
+        feed_user = User.objects.create_user(username='feeds')
+        Post.objects.create(text='от feeds', author=feed_user)
+        response = self.client_anon.get(
+            reverse('author_rss', kwargs={'username': 'feeds'})
+        )
+        self.assertEqual(response.content.count(b'<item>'), 1)
+
+    def test_site_routes_leave_user_pages_alone(self):
+        for username in ('search', 'export', 'api', 'feeds'):
+            User.objects.create_user(username=username)
+            for name in ('profile', 'author_rss', 'profile_follow',
+                         'profile_unfollow'):
+                url = reverse(name, kwargs={'username': username})
+                self.assertEqual(resolve(url).url_name, name)
+        response = self.client_anon.get(
+            reverse('profile', kwargs={'username': 'search'})
+        )
+        self.assertEqual(response.context['author'].username, 'search')
+
+    @override_settings(
+        BENCHMARK_DIR=os.path.join(TEMP_MEDIA_ROOT, 'benchmarks')
+    )
+    def test_seed_dataset_and_benchmark(self):
+        options = dict(users=30, groups=3, posts=60, image_pool=2,
+                       images=0.5, batch_size=25, stdout=StringIO())
+        call_command('seed_dataset', seed=7, **options)
+        seeded = Post.objects.filter(author__username__startswith='seed_')
+        self.assertEqual(seeded.count(), 60)
+        self.assertEqual(Group.objects.filter(
+            slug__startswith='seed-group-'
+        ).count(), 3)
+        self.assertTrue(seeded.exclude(image='').exists())
+        self.assertTrue(ThumbnailJob.objects.exists())
+        self.assertTrue(FeedEntry.objects.exists())
+        followers = sorted(
+            UserCounter.objects.values_list('followers_count', flat=True)
+        )
+        # Степенное распределение: у первого автора больше всех подписчиков.
+        self.assertEqual(
+            UserCounter.objects.get(user__username='seed_0').followers_count,
+            followers[-1],
+        )
+        comments = Comment.objects.filter(post__in=seeded)
+        self.assertEqual(
+            sum(seeded.values_list('comment_count', flat=True)),
+            comments.count(),
+        )
+        with self.assertRaises(CommandError):
+            call_command('seed_dataset', **options)
+        call_command(
+            'seed_dataset', prefix='other', seed=7, **options
+        )
+        self.assertEqual(
+            list(Post.objects.filter(
+                author__username__startswith='other_'
+            ).values_list('text', flat=True)),
+            list(seeded.values_list('text', flat=True)),
+        )
+
+        out = StringIO()
+        call_command(
+            'benchmark', requests=3, warmup=1, save='base', stdout=out,
+            stderr=StringIO(),
+        )
+        report = out.getvalue()
+        for view in ('index', 'follow_index', 'add_comment'):
+            self.assertIn(f'{view}: p50 ', report)
+        self.assertIn('ошибок: 0', report)
+        self.assertNotIn('ошибок: 1', report)
+        out = StringIO()
+        call_command(
+            'benchmark', requests=3, warmup=1, views='index,post_view',
+            compare='base', threshold=10 ** 6, stdout=out,
+            stderr=StringIO(),
+        )
+        self.assertIn('index p95: ', out.getvalue())
+        self.assertNotIn('РЕГРЕССИЯ', out.getvalue())
+
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiler = self.settings(
+            PROFILER_ENABLED=True, PROFILER_SAMPLE_RATE=0,
+            PROFILER_DIR=directory.name, PROFILER_KEEP=3,
+        )
+        profiler.enable()
+        self.addCleanup(profiler.disable)
+        self.staff = User.objects.create_user(
+            username='staff', is_staff=True
+        )
+        self.client.force_login(self.staff)
+        Post.objects.create(text='профиль', author=self.staff)
+
+    def test_profiles_staff_requests_with_header(self):
+        url = reverse('profile', kwargs={'username': 'staff'})
+        self.assertFalse(self.client.get(url).has_header('X-Profile'))
+        cache.clear()
+        response = self.client.get(url, HTTP_X_PROFILE='1')
+        name = response['X-Profile']
+        entry, = profiling.recent()
+        self.assertEqual(entry['name'], name)
+        self.assertEqual(entry['view'], 'profile')
+        self.assertEqual(set(entry['sections']), set(profiling.SECTIONS))
+        self.assertGreater(entry['sections']['sql'], 0)
+        self.assertGreater(entry['sections']['templates'], 0)
+        self.assertLessEqual(
+            sum(entry['sections'].values()), entry['total_ms'] + 1
+        )
+
+        response = self.client.get(reverse('request_profiles'))
+        self.assertContains(response, url)
+        response = self.client.get(
+            reverse('request_profile', kwargs={'name': name})
+        )
+        self.assertIn(b'profile', b''.join(response.streaming_content))
+        self.assertEqual(self.client.get(
+            reverse('request_profile', kwargs={'name': '..'})
+        ).status_code, 404)
+        self.assertEqual(Client().get(
+            reverse('request_profiles')
+        ).status_code, 302)
+
+    def test_sampling_and_rotation(self):
+        with self.settings(PROFILER_SAMPLE_RATE=1):
+            anonymous = Client()
+            for _ in range(5):
+                anonymous.get(reverse('index'))
+        self.assertEqual(len(profiling.recent()), 3)
+        self.assertEqual(len(os.listdir(profiling.profile_dir())), 6)
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        use_temporary_media(self)
+        call_command(
+            'seed_dataset', users=40, groups=3, posts=120, image_pool=2,
+            images=0.5, comments=5, batch_size=50, stdout=StringIO(),
+        )
+        thumbnails.drain()
+        self.viewer = UserCounter.objects.order_by(
+            '-following_count'
+        ).first().user
+        self.post = Post.objects.order_by('-comment_count').first()
+        self.author = self.post.author.username
+
+    def requests(self):
+        post_kwargs = {'username': self.author, 'post_id': self.post.pk}
+        author = {'username': self.author}
+        return [
+            ('get', reverse('index'), None),
+            ('get', reverse('group', kwargs={
+                'slug': Group.objects.first().slug
+            }), None),
+            ('get', reverse('search'), {'q': 'лес'}),
+            ('get', reverse('profile', kwargs=author), None),
+            ('get', reverse('post', kwargs=post_kwargs), None),
+            ('get', reverse('follow_index'), None),
+            ('get', reverse('new_post'), None),
+            ('post', reverse('new_post'), {'text': 'бюджет'}),
+            ('get', reverse('post_edit', kwargs=post_kwargs), None),
+            ('post', reverse('add_comment', kwargs=post_kwargs),
+             {'text': 'бюджет'}),
+            ('get', reverse('profile_follow', kwargs=author), None),
+            ('get', reverse('profile_unfollow', kwargs=author), None),
+            ('get', reverse('signup'), None),
+        ]
+
+    def test_views_fit_query_budgets(self):
+        anonymous, signed_in = Client(), Client()
+        signed_in.force_login(self.viewer)
+        for client in (anonymous, signed_in):
+            for method, url, data in self.requests():
+                with self.subTest(url=url, method=method):
+                    cache.clear()
+                    default.kvstore.lru_clear()
+                    response = getattr(client, method)(url, data)
+                    self.assertLess(response.status_code, 400)
+
+    def test_first_follow_and_post_fit_query_budgets(self):
+        # Дорогие пути: первая подписка заполняет ящик читателя, а первый
+        # пост автора раскладывается по ящикам всех подписчиков.
+        author = UserCounter.objects.order_by(
+            '-followers_count'
+        ).first().user
+        reader = User.objects.create_user(username='budget_reader')
+        client = Client()
+        client.force_login(reader)
+        for name in ('profile', 'profile_follow', 'profile_unfollow',
+                     'profile_follow'):
+            with self.subTest(view=name):
+                cache.clear()
+                response = client.get(
+                    reverse(name, kwargs={'username': author.username})
+                )
+                self.assertLess(response.status_code, 400)
+        self.assertTrue(
+            FeedEntry.objects.filter(user=reader, post__author=author)
+        )
+        client.force_login(author)
+        response = client.post(reverse('new_post'), {'text': 'первый'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(FeedEntry.objects.filter(
+            user=reader, post__text='первый'
+        ))
+
+    def test_budget_violation(self):
+        budgets = {'posts.views.post_view': 0}
+        url = reverse(
+            'post', kwargs={'username': self.author, 'post_id': self.post.pk}
+        )
+        with self.settings(QUERY_BUDGETS=budgets):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(url)
+            with self.settings(QUERY_BUDGET_STRICT=False):
+                with self.assertLogs('posts.query_budget', 'WARNING') as logs:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertIn('posts.views.post_view', logs.output[0])
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.group = Group.objects.create(title='gr_title', slug='gr_slug')
+        self.cursor = (timezone.now(), 1)
+
+    def assertUsesIndex(self, queryset):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            self.assertNotIn('TEMP B-TREE', line, plan)
+            if 'SCAN' in line:
+                self.assertIn('USING', line, plan)
+
+    def feed_windows(self, queryset, key=('pub_date', 'pk')):
+        for after, before in [(None, None), (self.cursor, None),
+                              (None, self.cursor)]:
+            yield keyset_queryset(queryset, after, before, key=key)
+
+    def test_feed_queries_use_indexes(self):
+        feeds = [
+            Post.objects.for_feed(),
+            self.group.posts.for_feed(),
+            self.user.posts.for_feed(),
+            Post.objects.filter(author=self.user).values_list(
+                'pub_date', 'pk'),
+        ]
+        for feed in feeds:
+            for queryset in self.feed_windows(feed):
+                self.assertUsesIndex(queryset)
+        inbox = FeedEntry.objects.filter(user=self.user).values_list(
+            'pub_date', 'post_id')
+        for queryset in self.feed_windows(inbox, ('pub_date', 'post_id')):
+            self.assertUsesIndex(queryset)
+
+    def test_counter_queries_use_indexes(self):
+        author = User.objects.create_user(username='author')
+        queries = [
+            UserCounter.objects.filter(user=author),
+            Follow.objects.filter(user=self.user, author=author),
+            Follow.objects.filter(author=author).values_list('user_id'),
+            Follow.objects.filter(
+                user=self.user, author__counters__followers_count__gt=1
+            ).values_list('author_id'),
+            Comment.objects.filter(post_id=1).select_related('author'),
+            Post.objects.filter(pk=1).for_feed(),
+        ]
+        for queryset in queries:
+            self.assertUsesIndex(queryset)
+
+
+class ImageIngestTests(TestCase):
+    def upload(self, image, image_format='JPEG', **options):
+        upload = TemporaryUploadedFile(
+            f'photo.{image_format.lower()}', 'image/jpeg', 0, None
+        )
+        image.save(upload, image_format, **options)
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+    def clean(self, upload):
+        form = PostForm({'text': 'photo'}, {'image': upload})
+        valid = form.is_valid()
+        return valid, form
+
+    def test_exif_orientation_applied_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'Camera'
+        upload = self.upload(
+            Image.new('RGB', (3000, 1000)), exif=exif.tobytes()
+        )
+        valid, form = self.clean(upload)
+        self.assertTrue(valid, form.errors)
+        with Image.open(form.cleaned_data['image']) as stored:
+            self.assertEqual(stored.size, (683, 2048))
+            self.assertEqual(dict(stored.getexif()), {})
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=10_000)
+    def test_pixel_limit_checked_before_decoding(self):
+        upload = self.upload(Image.new('RGB', (200, 200)))
+        with mock.patch.object(ImageFile.ImageFile, 'load') as load:
+            valid, form = self.clean(upload)
+        self.assertFalse(valid)
+        self.assertEqual(form.errors.as_data()['image'][0].code,
+                         'too_many_pixels')
+        load.assert_not_called()
+
+    def test_peak_memory_bounded(self):
+        upload = self.upload(Image.new('RGB', (6000, 4000), (200, 30, 30)))
+        decoded = []
+        load = ImageFile.ImageFile.load
+
+        def tracked_load(image):
+            decoded.append(image.size[0] * image.size[1])
+            return load(image)
+
+        tracemalloc.start()
+        try:
+            with mock.patch.object(ImageFile.ImageFile, 'load',
+                                   tracked_load):
+                valid, form = self.clean(upload)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertTrue(valid, form.errors)
+        # Картинка декодируется уменьшенной вдвое, а сам файл не читается
+        # в память целиком.
+        self.assertEqual(max(decoded), 3000 * 2000)
+        self.assertLess(peak, 8 * 1024 * 1024)
+        with Image.open(form.cleaned_data['image']) as stored:
+            self.assertEqual(stored.size, (2048, 1365))
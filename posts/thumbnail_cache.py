@@ -0,0 +1,187 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from . import page_cache
+from .models import Post, UserCounter
+
+ACCESS_KEY = 'thumbnail_cache:access:{}'
+EVICT_KEY = 'thumbnail_cache:evicted'
+
+
+def budget():
+    return getattr(settings, 'THUMBNAIL_CACHE_BUDGET', None)
+
+
+def evict_interval():
+    return getattr(settings, 'THUMBNAIL_CACHE_EVICT_INTERVAL', None)
+
+
+def orphan_min_age():
+    return getattr(settings, 'THUMBNAIL_CACHE_ORPHAN_MIN_AGE', 3600)
+
+
+def access_key(source_name):
+    return ACCESS_KEY.format(hashlib.md5(source_name.encode()).hexdigest())
+
+
+def touch(posts):
+    """Запоминает время показа миниатюр картинок постов."""
+    now = time.time()
+    keys = {access_key(post.image.name): now for post in posts if post.image}
+    if keys:
+        cache.set_many(keys, None)
+
+
+def scan():
+    """Имя файла в каталоге миниатюр -> (размер, время изменения)."""
+    storage = default.storage
+    root = storage.path(sorl_settings.THUMBNAIL_PREFIX)
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            relative = os.path.relpath(path, storage.path(''))
+            files[relative.replace(os.sep, '/')] = (
+                stat.st_size, stat.st_mtime
+            )
+    return files
+
+
+def thumbnail_owners():
+    """
+    Картинки и их миниатюры по записям sorl, одним проходом по таблице.
+
+    Возвращает (имя миниатюры -> ключ исходной картинки,
+    ключ исходной картинки -> её ImageFile).
+    """
+    images, lists = {}, {}
+    rows = KVStoreModel.objects.filter(
+        key__startswith=sorl_settings.THUMBNAIL_KEY_PREFIX
+    ).values_list('key', 'value')
+    image_prefix = add_prefix('', 'image')
+    thumbnails_prefix = add_prefix('', 'thumbnails')
+    for key, value in rows.iterator():
+        if key.startswith(image_prefix):
+            images[del_prefix(key)] = value
+        elif key.startswith(thumbnails_prefix):
+            lists[del_prefix(key)] = deserialize(value)
+    owners, sources = {}, {}
+    for source_key, thumbnail_keys in lists.items():
+        if source_key not in images:
+            continue
+        sources[source_key] = deserialize_image_file(images[source_key])
+        for thumbnail_key in thumbnail_keys:
+            if thumbnail_key in images:
+                name = deserialize(images[thumbnail_key])['name']
+                owners[name] = source_key
+    return owners, sources
+
+
+def release_source(source):
+    """
+    Удаляет миниатюры картинки вместе с записями sorl о них.
+
+    Посты с этой картинкой снова ждут миниатюр: их карточки и страницы
+    сбрасываются, а задание на построение ставится при следующем показе.
+    """
+    default.kvstore.delete_thumbnails(source)
+    posts = list(Post.objects.select_related('author', 'group').filter(
+        image=source.name, thumbnails_ready=True
+    ))
+    Post.objects.filter(pk__in=[post.pk for post in posts]).update(
+        thumbnails_ready=False
+    )
+    UserCounter.touch(*{post.author_id for post in posts})
+    for post in posts:
+        group_slug = post.group.slug if post.group_id else None
+        page_cache.bump(*page_cache.post_tags(post, {group_slug}))
+
+
+def evict(limit, dry_run=False, min_age=None):
+    """
+    Ужимает каталог миниатюр до limit байт.
+
+    Первыми удаляются файлы, о которых sorl ничего не знает (миниатюры
+    удалённых постов и старых пресетов), затем миниатюры картинок, дольше
+    всех не показывавшихся, целиком по картинке. Ничьи файлы моложе
+    min_age секунд не трогаются: обработчик мог записать миниатюру и ещё
+    не успеть сохранить запись sorl о ней. Возвращает статистику.
+    """
+    if min_age is None:
+        min_age = orphan_min_age()
+    files = scan()
+    total = sum(size for size, _ in files.values())
+    stats = {
+        'files': len(files), 'bytes': total,
+        'orphans': 0, 'sources': 0, 'freed': 0,
+    }
+    if total <= limit:
+        return stats
+
+    owners, sources = thumbnail_owners()
+    deadline = time.time() - min_age
+    orphans = sorted(
+        (mtime, name) for name, (_, mtime) in files.items()
+        if name not in owners and mtime <= deadline
+    )
+    for mtime, name in orphans:
+        if total <= limit:
+            return stats
+        size = files[name][0]
+        if not dry_run:
+            default.storage.delete(name)
+        total -= size
+        stats['orphans'] += 1
+        stats['freed'] += size
+
+    groups = {}
+    for name, (size, mtime) in files.items():
+        if name in owners:
+            group = groups.setdefault(owners[name], [0, 0])
+            group[0] += size
+            group[1] = max(group[1], mtime)
+    keys = {
+        source_key: access_key(sources[source_key].name)
+        for source_key in groups
+    }
+    accessed = cache.get_many(keys.values())
+    order = sorted(
+        (accessed.get(keys[source_key], mtime), source_key)
+        for source_key, (_, mtime) in groups.items()
+    )
+    for _, source_key in order:
+        if total <= limit:
+            break
+        size = groups[source_key][0]
+        if not dry_run:
+            release_source(sources[source_key])
+        total -= size
+        stats['sources'] += 1
+        stats['freed'] += size
+    return stats
+
+
+def maybe_evict():
+    """
+    Периодический запуск evict() из обработчика заданий миниатюр.
+
+    Не чаще раза в THUMBNAIL_CACHE_EVICT_INTERVAL секунд на все процессы;
+    без этой настройки или бюджета ничего не делает.
+    """
+    interval, limit = evict_interval(), budget()
+    if interval is None or limit is None:
+        return None
+    if not cache.add(EVICT_KEY, 1, interval):
+        return None
+    return evict(limit)
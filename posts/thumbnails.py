@@ -0,0 +1,308 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import connection, connections, transaction
+from PIL import ImageFile as PILImageFile
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from . import page_cache, thumbnail_cache
+from .models import Post, ThumbnailJob, UserCounter
+from .profiling import timed
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+
+# Прогрессивный JPEG кодируется в один буфер: с буфером Pillow по
+# умолчанию (64 КБ) маленькие миниатюры с крупным ICC-профилем не
+# сохраняются («Suspension not allowed here»).
+PILImageFile.MAXBLOCK = max(PILImageFile.MAXBLOCK, 1024 * 1024)
+
+_executor = None
+
+
+def presets():
+    """Имя пресета -> (геометрия, опции sorl) из THUMBNAIL_PRESETS."""
+    return getattr(settings, 'THUMBNAIL_PRESETS', {
+        'card_960_jpeg': ('960x339', {'crop': 'center', 'upscale': True}),
+    })
+
+
+def presets_version():
+    """Меняется при правке THUMBNAIL_PRESETS, чтобы сбросить карточки."""
+    raw = repr(sorted(presets().items()))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def variants(family):
+    """
+    Пресеты семейства (card_<ширина>_<формат>) по форматам.
+
+    Возвращает {формат sorl: [(ширина, высота, пресет), ...]} с ширинами
+    по возрастанию; JPEG, если он есть, идёт последним как запасной.
+    """
+    groups = {}
+    for name, (geometry, options) in sorted(presets().items()):
+        if not name.startswith(f'{family}_'):
+            continue
+        width, height = (int(part) for part in geometry.split('x'))
+        image_format = options.get('format', 'JPEG').upper()
+        groups.setdefault(image_format, []).append((width, height, name))
+    for items in groups.values():
+        items.sort()
+    return dict(sorted(groups.items(), key=lambda item: item[0] == 'JPEG'))
+
+
+def thumbnail_options(source, options):
+    """Опции, с которыми sorl считает имя миниатюры, как в get_thumbnail."""
+    backend = default.backend
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def thumbnail_file(image, preset):
+    """ImageFile миниатюры пресета; сам файл может ещё не существовать."""
+    geometry, options = presets()[preset]
+    source = ImageFile(image)
+    name = default.backend._get_thumbnail_filename(
+        source, geometry, thumbnail_options(source, options)
+    )
+    return ImageFile(name, default.storage)
+
+
+@timed('thumbnails')
+def lookup(image, preset):
+    """Готовая миниатюра из хранилища ключей sorl или None. Не генерирует."""
+    if not image:
+        return None
+    return default.kvstore.get(thumbnail_file(image, preset))
+
+
+@timed('thumbnails')
+def prefetch(posts):
+    """
+    Загружает записи о готовых миниатюрах постов одним пакетом.
+
+    Работает, если хранилище ключей умеет prefetch (posts.kvstore.KVStore);
+    после этого lookup() для этих постов обходится без кеша и БД.
+    """
+    kvstore = default.kvstore
+    if not hasattr(kvstore, 'prefetch'):
+        return
+    keys = [
+        add_prefix(thumbnail_file(post.image, preset).key)
+        for post in posts if post.image and post.thumbnails_ready
+        for preset in presets()
+    ]
+    if keys:
+        kvstore.prefetch(keys)
+
+
+def responsive(image, family):
+    """
+    Готовые варианты семейства для <picture> или None, если какого-то нет.
+
+    Результат: список (mime, srcset, самый широкий вариант) в порядке
+    variants(), последний элемент — запасной формат для <img>.
+    """
+    if not image:
+        return None
+    sources = []
+    for image_format, items in variants(family).items():
+        candidates = []
+        for width, height, name in items:
+            thumbnail = lookup(image, name)
+            if thumbnail is None:
+                return None
+            candidates.append(f'{thumbnail.url} {width}w')
+        sources.append((
+            f'image/{image_format.lower()}', ', '.join(candidates),
+            {'url': thumbnail.url, 'width': width, 'height': height},
+        ))
+    return sources or None
+
+
+@timed('thumbnails')
+def generate(post):
+    """Строит все пресеты для картинки поста и отмечает их готовность."""
+    for geometry, options in presets().values():
+        get_thumbnail(post.image, geometry, **options)
+    updated = Post.objects.filter(pk=post.pk, image=post.image.name).update(
+        thumbnails_ready=True, thumbnails_version=presets_version()
+    )
+    if updated:
+        UserCounter.touch(post.author_id)
+        group_slug = post.group.slug if post.group_id else None
+        page_cache.bump(*page_cache.post_tags(post, {group_slug}))
+
+
+def build_chunk(pks, force=False):
+    """
+    Строит миниатюры пакета постов; возвращает (успешно, с ошибкой).
+
+    С force старые миниатюры и записи о них удаляются, чтобы построить
+    их заново, например после переезда хранилища.
+    """
+    done = failed = 0
+    posts = Post.objects.select_related('author', 'group').filter(
+        pk__in=pks
+    ).exclude(image='')
+    for post in posts:
+        try:
+            if force:
+                default.kvstore.delete_thumbnails(ImageFile(post.image))
+            generate(post)
+        except Exception:
+            logger.exception(
+                'Не удалось построить миниатюры поста %s', post.pk
+            )
+            failed += 1
+        else:
+            done += 1
+    return done, failed
+
+
+def init_process(niceness):
+    """Настройка процесса пула backfill_thumbnails."""
+    django.setup()
+    if niceness:
+        os.nice(niceness)
+
+
+def run_job(job):
+    post = job.post
+    try:
+        if post.image:
+            generate(post)
+    except Exception:
+        logger.exception('Не удалось построить миниатюры поста %s', post.pk)
+        ThumbnailJob.objects.filter(pk=job.pk).update(
+            attempts=job.attempts + 1
+        )
+        return False
+    ThumbnailJob.objects.filter(pk=job.pk).delete()
+    try:
+        thumbnail_cache.maybe_evict()
+    except Exception:
+        logger.exception('Не удалось ужать каталог миниатюр')
+    return True
+
+
+def drain(limit=None):
+    """Выполняет накопившиеся задания; возвращает (успешно, с ошибкой)."""
+    jobs = ThumbnailJob.objects.select_related('post').filter(
+        attempts__lt=MAX_ATTEMPTS
+    )
+    if limit is not None:
+        jobs = jobs[:limit]
+    done = failed = 0
+    for job in jobs:
+        if run_job(job):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def workers_enabled():
+    """
+    Пул потоков не используется с базой SQLite в памяти (тесты): её
+    блокировки таблиц не ждут, и запрос падал бы вместо ожидания.
+    """
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        return False
+    return bool(getattr(settings, 'THUMBNAIL_WORKERS', 0))
+
+
+def run_job_in_worker(job_id):
+    try:
+        job = ThumbnailJob.objects.select_related('post').filter(
+            pk=job_id
+        ).first()
+        if job is not None:
+            run_job(job)
+    finally:
+        connections.close_all()
+
+
+def run_post_jobs_in_worker(post_ids):
+    try:
+        for job in ThumbnailJob.objects.select_related('post').filter(
+            post_id__in=post_ids, attempts__lt=MAX_ATTEMPTS
+        ):
+            run_job(job)
+    finally:
+        connections.close_all()
+
+
+def ensure_jobs(posts):
+    """
+    Ставит задания для постов, у которых нет миниатюр или они построены
+    по прежним THUMBNAIL_PRESETS, если заданий для них ещё нет.
+    """
+    version = presets_version()
+    waiting = [
+        post for post in posts if post.image and (
+            not post.thumbnails_ready or post.thumbnails_version != version
+        )
+    ]
+    if not waiting:
+        return
+    queued = set(ThumbnailJob.objects.filter(
+        post__in=waiting
+    ).values_list('post_id', flat=True))
+    missing = [post for post in waiting if post.pk not in queued]
+    if not missing:
+        return
+    # Одна вставка на страницу: после правки пресетов в очередь встают
+    # все её посты сразу.
+    ThumbnailJob.objects.bulk_create(
+        [ThumbnailJob(post=post) for post in missing]
+    )
+    if workers_enabled():
+        post_ids = [post.pk for post in missing]
+        transaction.on_commit(
+            lambda: executor().submit(run_post_jobs_in_worker, post_ids)
+        )
+
+
+def schedule(post):
+    """
+    Ставит построение миниатюр в очередь.
+
+    Задание остаётся в таблице, пока его не выполнит пул потоков
+    (THUMBNAIL_WORKERS > 0) после фиксации транзакции или команда
+    process_thumbnail_jobs.
+    """
+    job = ThumbnailJob.objects.create(post=post)
+    if workers_enabled():
+        transaction.on_commit(
+            lambda: executor().submit(run_job_in_worker, job.pk)
+        )
+    return job
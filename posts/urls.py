@@ -1,13 +1,32 @@
 from django.urls import path
 
-from . import views
+from . import api, feeds, views
 
 urlpatterns = [
     path('', views.index, name='index'),
     path('new/', views.new_post, name='new_post'),
+    # Адреса сайта не должны совпадать с адресами пользователей: search/
+    # закрыл бы профиль пользователя search, а api/follow/ — подписку на
+    # пользователя api. Поэтому второй сегмент здесь не число и не rss,
+    # atom, follow или unfollow.
+    path('search/posts/', views.search, name='search'),
+    path('export/all/', views.export_content, name='export'),
+    path('api/posts/', api.index, name='api_index'),
+    path('api/group/<slug:slug>/', api.group_posts, name='api_group'),
+    path('api/follow/posts/', api.follow_index, name='api_follow'),
+    path('api/posts/<int:post_id>/', api.post_view, name='api_post'),
+    path(
+        'api/profile/<str:username>/', api.profile, name='api_profile'
+    ),
+    path('feeds/all/rss/', feeds.site_rss, name='rss'),
+    path('feeds/all/atom/', feeds.site_atom, name='atom'),
     path('group/<slug:slug>/', views.group_posts, name='group'),
+    path('group/<slug:slug>/rss/', feeds.group_rss, name='group_rss'),
+    path('group/<slug:slug>/atom/', feeds.group_atom, name='group_atom'),
     path("follow/", views.follow_index, name="follow_index"),
     path('<str:username>/', views.profile, name='profile'),
+    path('<str:username>/rss/', feeds.author_rss, name='author_rss'),
+    path('<str:username>/atom/', feeds.author_atom, name='author_atom'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
     path(
         "<str:username>/follow/",
@@ -1,18 +1,28 @@
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import (FileResponse, Http404, HttpResponseBadRequest,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 
+from . import export, profiling
+from .conditional import conditional_page, post_version, profile_version
+from .follow_feed import paginate_follow_feed
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Follow, Group, Post, User, UserCounter
+from .page_cache import (cache_page_tagged, follow_tags, group_tags,
+                         index_tags, profile_tags)
+from .pagination import paginate
+from .query_budget import query_budget
+from .search import search_posts
 
 
-@cache_page(20, key_prefix='index_page')
+@query_budget(6)
+@cache_page_tagged(index_tags)
 def index(request):
-    post_list = Post.objects.select_related('group').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    paginator, page = paginate(request, post_list)
     return render(
         request,
         'index.html',
@@ -20,12 +30,12 @@ def index(request):
         )
 
 
+@query_budget(7)
+@cache_page_tagged(group_tags)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = group.posts.for_feed()
+    paginator, page = paginate(request, posts)
     return render(
         request,
         'group.html',
@@ -33,6 +43,64 @@ def group_posts(request, slug):
         )
 
 
+@query_budget(6)
+def search(request):
+    paginator, page = search_posts(request)
+    return render(
+        request,
+        'posts/search.html',
+        {
+            'query': request.GET.get('q', '').strip(),
+            'page': page,
+            'paginator': paginator,
+            }
+        )
+
+
+@staff_member_required
+def export_content(request):
+    """Потоковая выгрузка данных для сотрудников, как export_content."""
+    format = request.GET.get('format', 'jsonl')
+    if format not in export.RENDERERS:
+        return HttpResponseBadRequest('Неизвестный формат')
+    try:
+        kinds = export.parse_kinds(request.GET.get('kinds'))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    render_rows, content_type = export.RENDERERS[format]
+    response = StreamingHttpResponse(
+        render_rows(export.rows(kinds)),
+        content_type=f'{content_type}; charset=utf-8'
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="yatube.{format}"'
+    )
+    return response
+
+
+@staff_member_required
+def request_profiles(request):
+    """Самые медленные из сохранённых профилей запросов."""
+    context = dict(
+        admin.site.each_context(request),
+        title='Профили запросов',
+        entries=profiling.recent(),
+        enabled=profiling.enabled(),
+    )
+    return render(request, 'posts/request_profiles.html', context)
+
+
+@staff_member_required
+def request_profile(request, name):
+    path = profiling.profile_path(name)
+    if path is None:
+        raise Http404
+    return FileResponse(
+        open(path, 'rb'), as_attachment=True, filename=f'{name}.prof'
+    )
+
+
+@query_budget(13)
 @login_required
 def new_post(request):
     if request.method == 'POST':
@@ -40,50 +108,54 @@ def new_post(request):
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
-            post.save()
+            with transaction.atomic():
+                post.save()
             return redirect('index')
         return render(request, 'posts/new_post.html', {'form': form})
     form = PostForm()
     return render(request, 'posts/new_post.html', {'form': form})
 
 
+@query_budget(10)
+@conditional_page(profile_version)
+@cache_page_tagged(profile_tags)
 def profile(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
     posts = author.posts.all()
     post = posts.first()
-    posts_count = posts.count()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    counters = UserCounter.get_for(author)
+    paginator, page = paginate(request, posts.for_feed())
     following = Follow.objects.filter(
         user__username=user, author__username=author
         ).exists()
-    count_followers = author.following.count()
-    count_following = author.follower.count()
 
     context = {
         'author': author,
         'user': user,
-        'posts_count': posts_count,
+        'posts_count': counters.posts_count,
         'page': page,
         'paginator': paginator,
         'post': post,
         'following': following,
-        'count_followers': count_followers,
-        'count_following': count_following,
+        'count_followers': counters.followers_count,
+        'count_following': counters.following_count,
     }
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(8)
+@conditional_page(post_version)
 def post_view(request, username, post_id):
     user = request.user
-    post = get_object_or_404(Post, pk=post_id, author__username=username)
-    comments = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.for_feed(), pk=post_id, author__username=username
+    )
+    comments = post.comments.select_related('author')
     form = CommentForm()
 
     author = post.author
-    posts_count = author.posts.count()
+    posts_count = UserCounter.get_for(author).posts_count
     return render(
         request,
         'posts/post.html',
@@ -98,6 +170,7 @@ def post_view(request, username, post_id):
         )
 
 
+@query_budget(12)
 @login_required
 def post_edit(request, username, post_id):
     post = get_object_or_404(Post, pk=post_id, author__username=username)
@@ -133,6 +206,7 @@ def server_error(request):
     return render(request, "misc/500.html", status=500)
 
 
+@query_budget(11)
 @login_required
 def add_comment(request, username, post_id):
     post = get_object_or_404(Post, pk=post_id, author__username=username)
@@ -141,7 +215,8 @@ def add_comment(request, username, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
         return redirect('post', username=username, post_id=post_id)
     return render(
         request,
@@ -150,13 +225,11 @@ def add_comment(request, username, post_id):
     )
 
 
+@query_budget(8)
 @login_required
+@cache_page_tagged(follow_tags)
 def follow_index(request):
-    user = request.user
-    posts = Post.objects.filter(author__following__user=user)
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator, page = paginate_follow_feed(request, request.user)
     return render(
         request,
         "posts/follow.html",
@@ -164,6 +237,7 @@ def follow_index(request):
     )
 
 
+@query_budget(14)
 @login_required
 def profile_follow(request, username):
     user = request.user
@@ -172,10 +246,12 @@ def profile_follow(request, username):
     same_user = (user == author)
     if follow_exist or same_user:
         return redirect('profile', username=username)
-    Follow.objects.create(user=user, author=author)
+    with transaction.atomic():
+        Follow.objects.create(user=user, author=author)
     return redirect('profile', username=author.username)
 
 
+@query_budget(11)
 @login_required
 def profile_unfollow(request, username):
     user = request.user
@@ -1,8 +1,10 @@
 from django.views.generic import CreateView
 from django.urls import reverse_lazy
+from posts.query_budget import query_budget
 from .forms import CreationForm
 
 
+@query_budget(10)
 class SignUp(CreateView):
     form_class = CreationForm
     success_url = reverse_lazy('login')
@@ -51,10 +51,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'posts.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'posts.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -145,8 +147,120 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 1
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Поколения тегов страниц и карточки постов сбрасывают воркеры, команды и
+# фоновые обработчики, поэтому кеш нужен общий: memcached по адресу из
+# MEMCACHED_LOCATION. Без него (разработка, тесты) кеш живёт в памяти
+# процесса, и страницы в нём, как и поколения тегов для ETag, живут не
+# дольше PAGE_CACHE_LOCAL_TTL секунд.
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'].split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
+
+POSTS_PER_PAGE = 10
+
+# Постов в RSS и Atom лентах сайта, групп и авторов.
+SYNDICATION_FEED_SIZE = 20
+
+# Бюджеты запросов к базе задаются у view декоратором query_budget;
+# QUERY_BUDGETS переопределяет их по пути view: {'posts.views.index': 5}
+# или {'posts.views.index': (5, 20)} с лимитом миллисекунд SQL. Превышение
+# пишется в лог, со строгим режимом — выбрасывает исключение.
+QUERY_BUDGETS = {}
+QUERY_BUDGET_STRICT = False
+# manage.py test включает строгий режим для всех тестов.
+TEST_RUNNER = 'yatube.test_runner.StrictQueryBudgetRunner'
+
+# Профилирование запросов: доля случайных запросов и запросы сотрудников с
+# заголовком X-Profile. В PROFILER_DIR хранятся PROFILER_KEEP последних
+# дампов cProfile, список самых медленных — в /admin/profiles/.
+PROFILER_ENABLED = False
+PROFILER_SAMPLE_RATE = 0.01
+PROFILER_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILER_KEEP = 200
+
+# Лента «Избранные авторы»: посты раскладываются по ящикам подписчиков
+# при публикации. В ящике хранятся только последние FOLLOW_FEED_INBOX_SIZE
+# записей, более старые посты в ленте подписок не показываются.
+FOLLOW_FEED_INBOX = True
+FOLLOW_FEED_INBOX_SIZE = 500
+# Посты авторов, у которых подписчиков больше порога, по ящикам не
+# раскладываются, а подмешиваются в ленту при чтении. None — только ящики.
+# Когда подписчиков снова не больше порога, посты автора раскладывает по
+# ящикам команда unpull_follow_feeds (запускается по расписанию).
+FOLLOW_FEED_PULL_THRESHOLD = 1000
+
+# Кеш страниц лент: срок свежести с разбросом (с кешем в памяти процесса —
+# не больше PAGE_CACHE_LOCAL_TTL), окно, в течение которого отдаётся
+# устаревшая копия, пока один запрос её пересчитывает, и время жизни аренды
+# на пересчёт.
+PAGE_CACHE_TTL = 600
+PAGE_CACHE_LOCAL_TTL = 20
+PAGE_CACHE_JITTER = 0.1
+PAGE_CACHE_GRACE = 30
+PAGE_CACHE_LOCK_TIMEOUT = 10
+# Время жизни HTML карточек постов в кеше, секунд.
+POST_CARD_CACHE_TTL = 3600
+
+# Сколько секунд промежуточные кеши могут отдавать страницы постов и
+# профилей анонимам без перепроверки по ETag.
+PAGE_MAX_AGE = 60
+
+# Миниатюры строятся заранее, при сохранении картинки поста. Шаблоны только
+# ищут готовые варианты и до их появления показывают заглушку.
+# Карточка поста отдаётся в нескольких ширинах, каждая в WebP и в JPEG
+# для браузеров без WebP; пресеты card_<ширина>_<формат> собираются в srcset.
+THUMBNAIL_CARD_WIDTHS = (320, 640, 960)
+THUMBNAIL_CARD_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'progressive': True},
 }
+THUMBNAIL_PRESETS = {
+    f'card_{width}_{name}': (
+        f'{width}x{round(width * 339 / 960)}',
+        {'crop': 'center', 'upscale': True, **options},
+    )
+    for width in THUMBNAIL_CARD_WIDTHS
+    for name, options in THUMBNAIL_CARD_FORMATS.items()
+}
+THUMBNAIL_CARD_SIZES = '(max-width: 768px) 100vw, 730px'
+# Потоки, которые строят миниатюры после сохранения поста. При 0 задания
+# выполняет только команда process_thumbnail_jobs.
+THUMBNAIL_WORKERS = 2
+# Записи sorl о готовых миниатюрах: LRU в памяти процесса перед общим
+# кешем и базой, заполняется сразу для всей страницы ленты.
+THUMBNAIL_KVSTORE = 'posts.kvstore.KVStore'
+THUMBNAIL_KVSTORE_LRU_SIZE = 5000
+THUMBNAIL_KVSTORE_LRU_TTL = 300
+
+# Загрузки всегда пишутся во временный файл на диске, а не в память.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Временные файлы создаются с правами 0600; без явных прав такими же
+# остались бы загрузки и миниатюры, недоступные веб-серверу.
+FILE_UPLOAD_PERMISSIONS = 0o644
+# Ограничения картинки поста: размер файла, число точек по заголовку,
+# число точек, которое разрешено декодировать, и сторона после уменьшения.
+POST_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 50_000_000
+POST_IMAGE_MAX_DECODED_PIXELS = 16_000_000
+POST_IMAGE_MAX_SIDE = 2048
+
+# Бюджет каталога миниатюр в байтах. Раз в интервал (секунд) обработчик
+# заданий вытесняет давно не показанные миниатюры; вручную — командой
+# evict_thumbnails. Файлы без записи sorl моложе ORPHAN_MIN_AGE секунд
+# не удаляются: запись о только что построенной миниатюре может ещё не
+# появиться.
+THUMBNAIL_CACHE_BUDGET = 2 * 1024 ** 3
+THUMBNAIL_CACHE_EVICT_INTERVAL = 3600
+THUMBNAIL_CACHE_ORPHAN_MIN_AGE = 3600
@@ -5,7 +5,19 @@ from django.contrib import admin
 from django.contrib.flatpages import views
 from django.urls import path, include
 
+from posts import views as posts_views
+
 urlpatterns = [
+    path(
+        'admin/profiles/',
+        posts_views.request_profiles,
+        name='request_profiles'
+        ),
+    path(
+        'admin/profiles/<str:name>/',
+        posts_views.request_profile,
+        name='request_profile'
+        ),
     path('admin/', admin.site.urls, name='admin'),
     path('about/', include('django.contrib.flatpages.urls')),
     path('auth/', include('users.urls')),